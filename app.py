@@ -1,19 +1,67 @@
-from flask import Flask, render_template, request, jsonify, send_file
-import pandas as pd
-import json
+from flask import Flask, render_template, request, jsonify, send_file, session, Response, url_for
+from flask.json.provider import DefaultJSONProvider
+from flask_compress import Compress
+import orjson
 import os
 import re
+import csv
+import io
+import math
+import random
 from werkzeug.utils import secure_filename
-import tempfile
+from werkzeug.security import safe_join
+from urllib.parse import quote
+from pathlib import Path
 import google.generativeai as genai
+from google.api_core.exceptions import ResourceExhausted, ServiceUnavailable, DeadlineExceeded
 from datetime import datetime
 import time
+import asyncio
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import queue
+import hashlib
+from typing import TypedDict
+from collections import defaultdict, deque, OrderedDict
+from operator import itemgetter
+from functools import lru_cache
+import sqlite3
+import numpy as np
+import uuid
+from keyword_store import MemoryJobStore, MemoryKeywordStore, SqliteJobStore, SqliteKeywordStore
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider that serializes and parses with orjson"""
+
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 app = Flask(__name__)
-app.config['SECRET_KEY'] = 'your-secret-key-here'
-app.config['UPLOAD_FOLDER'] = 'uploads'
+app.json = OrjsonProvider(app)
+# Keep keys in insertion order and skip pretty-printing, even in debug mode
+app.json.sort_keys = False
+app.json.compact = True
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
+# Compress JSON responses (keyword lists repeat the same keys on every row) and the dashboard page
+app.config['COMPRESS_MIMETYPES'] = ['application/json', 'text/html']
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+app.config['COMPRESS_LEVEL'] = 6
+app.config['COMPRESS_MIN_SIZE'] = 1024
+Compress(app)
+
 # Configure Gemini AI
 import os
 from dotenv import load_dotenv
@@ -21,19 +69,87 @@ from dotenv import load_dotenv
 # Load environment variables from .env file
 load_dotenv()
 
+# Secret used to sign the session cookie that identifies each user's keywords
+app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', 'your-secret-key-here')
+
+# Request threads only queue their log records; a listener thread writes them to stdout.
+# Set LOG_LEVEL=DEBUG to also log raw Gemini responses and request payloads
+logger = logging.getLogger(__name__)
+logger.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+logger.propagate = False
+_log_queue = queue.SimpleQueue()
+logger.addHandler(QueueHandler(_log_queue))
+_log_listener = QueueListener(_log_queue, logging.StreamHandler(sys.stdout))
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 if not GEMINI_API_KEY:
-    print("❌ Error: GEMINI_API_KEY environment variable not set")
-    print("Please set your Gemini API key in the .env file or as an environment variable")
+    logger.error("❌ Error: GEMINI_API_KEY environment variable not set")
+    logger.info("Please set your Gemini API key in the .env file or as an environment variable")
     exit(1)
 
 genai.configure(api_key=GEMINI_API_KEY)
 
-# Ensure upload folder exists
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+# Gemini concurrency settings
+GEMINI_MAX_CONCURRENCY = int(os.getenv('GEMINI_MAX_CONCURRENCY', '8'))
+GEMINI_TIMEOUT = float(os.getenv('GEMINI_TIMEOUT', '120'))
+# Gemini quota: requests and (estimated) input tokens per minute, and retries on rate limits
+GEMINI_RPM = int(os.getenv('GEMINI_RPM', '60'))
+GEMINI_TPM = int(os.getenv('GEMINI_TPM', '1000000'))
+GEMINI_MAX_RETRIES = 3
+# H2 sections written per Gemini request (1 = every section in its own concurrent request)
+GEMINI_SECTIONS_PER_CALL = max(1, int(os.getenv('GEMINI_SECTIONS_PER_CALL', '1')))
+
+# Generated content cache settings
+PROMPT_CACHE_PATH = os.getenv('PROMPT_CACHE_PATH', 'prompt_cache.db')
+# Cosine similarity needed for a near-duplicate match (e.g. 0.95); empty disables it
+PROMPT_CACHE_SIMILARITY = float(os.getenv('PROMPT_CACHE_SIMILARITY') or 0)
+# Seconds a cached article stays valid (default one week); 0 keeps entries forever
+PROMPT_CACHE_TTL = float(os.getenv('PROMPT_CACHE_TTL') or 604800)
+EMBEDDING_MODEL = 'models/text-embedding-004'
+
+# Precompiled regular expressions
+_HYPHEN_RUN_RE = re.compile(r'-+')
+_HANDLE_RE = re.compile(r'^[a-z0-9]+(?:-[a-z0-9]+)*$')
+_HANDLE_CHARS_RE = re.compile(r'^[a-z0-9-]+$')
+_TAG_RE = re.compile(r'^[a-zA-Z0-9\s]+$')
+_FILENAME_STRIP_RE = re.compile(r'[^\w\s-]')
+_FILENAME_SPACE_RE = re.compile(r'[-\s]+')
+_ARTICLE_NAME_RE = re.compile(r'[\w-]+\.json')
+_FAQ_QUESTION_RE = re.compile(r'<h2[^>]*>(.*?)</h2>', re.DOTALL | re.IGNORECASE)
+_FAQ_ANSWER_RE = re.compile(r'<p[^>]*>(.*?)</p>', re.DOTALL | re.IGNORECASE)
+_HTML_TAG_RE = re.compile(r'<[^>]+>')
+_TRAILING_COMMA_RE = re.compile(r',(\s*[}\]])')
+_TRAILING_JUNK_RE = re.compile(r'[^\w\s\{\}\[\]",:.\-_\s]+$')
+_TRAILING_QUOTE_RE = re.compile(r"'$")
 
-# Global variable to store current data
-current_data = None
+# Error bodies that never change, serialized once at import
+_NO_DATA_JSON = orjson.dumps({'error': 'No data loaded'})
+_FILE_NOT_FOUND_JSON = orjson.dumps({'error': 'File not found'})
+_SERVE_ERROR_JSON = orjson.dumps({'error': 'Error serving file'})
+
+def _static_error(body, status):
+    """Build an error response around one of the pre-serialized bodies above"""
+    return Response(body, status=status, mimetype='application/json')
+
+# Keyword data for each browser session. In memory by default; set
+# KEYWORD_STORE_PATH to keep it in a SQLite file shared by all server processes
+KEYWORD_STORE_PATH = os.getenv('KEYWORD_STORE_PATH')
+# Sessions untouched for this many seconds are dropped on the next upload (0 keeps them)
+KEYWORD_SESSION_TTL = float(os.getenv('KEYWORD_SESSION_TTL') or 86400)
+keyword_store = (
+    SqliteKeywordStore(KEYWORD_STORE_PATH, KEYWORD_SESSION_TTL) if KEYWORD_STORE_PATH
+    else MemoryKeywordStore(KEYWORD_SESSION_TTL)
+)
+
+def get_session_id():
+    """Return the id of the current browser session, assigning one on first use"""
+    sid = session.get('sid')
+    if sid is None:
+        sid = uuid.uuid4().hex
+        session['sid'] = sid
+    return sid
 
 def validate_handle(handle):
     """
@@ -52,10 +168,14 @@ def validate_handle(handle):
         return False, "Handle cannot be empty"
     
     # Replace spaces with hyphens
-    handle = re.sub(r'\s+', '-', handle)
+    handle = '-'.join(handle.split())
+    
+    # A well-formed handle passes in one match; the checks below only explain what is wrong
+    if _HANDLE_RE.match(handle):
+        return True, handle
     
     # Check if handle contains only valid characters (letters, numbers, hyphens)
-    if not re.match(r'^[a-z0-9-]+$', handle):
+    if not _HANDLE_CHARS_RE.match(handle):
         return False, "Handle can only contain lowercase letters, numbers, and hyphens"
     
     # Check if handle starts or ends with hyphen
@@ -87,7 +207,7 @@ def validate_tags(tags, handle=None):
     # If handle is provided, automatically sync tags to match handle content with spaces
     if handle:
         # Convert handle back to space-separated format (reverse of handle processing)
-        handle_with_spaces = re.sub(r'-+', ' ', handle).strip()
+        handle_with_spaces = _HYPHEN_RUN_RE.sub(' ', handle).strip()
         # Use the handle content as the primary tag
         return True, handle_with_spaces
     
@@ -103,53 +223,466 @@ def validate_tags(tags, handle=None):
     
     # Check each tag for valid characters (letters, numbers, spaces)
     for tag in tag_list:
-        if not re.match(r'^[a-zA-Z0-9\s]+$', tag):
+        if not (tag.isascii() and ''.join(tag.split()).isalnum()) and not _TAG_RE.match(tag):
             return False, f"Tag '{tag}' contains invalid characters. Only letters, numbers, and spaces are allowed"
     
     return True, ', '.join(tag_list)
 
+def validate_identifier(identifier):
+    """
+    Validate an identifier's handle and tags, replacing them with their cleaned values
+    Returns None if the identifier is valid, otherwise the error message
+    """
+    if not isinstance(identifier, dict):
+        return None
+    
+    if 'handle' in identifier:
+        is_valid, result = validate_handle(identifier['handle'])
+        if not is_valid:
+            return f'Invalid handle: {result}'
+        identifier['handle'] = result  # Use validated handle
+    
+    if 'tags' in identifier:
+        # Get the validated handle to sync tags
+        is_valid, result = validate_tags(identifier['tags'], identifier.get('handle', ''))
+        if not is_valid:
+            return f'Invalid tags: {result}'
+        identifier['tags'] = result  # Use validated tags
+    return None
+
+def keyword_to_filename(keyword):
+    """Clean a keyword for use as a filename: remove special chars, replace spaces with underscores"""
+    return _FILENAME_SPACE_RE.sub('_', _FILENAME_STRIP_RE.sub('', keyword)).lower()
+
+@lru_cache(maxsize=8)
+def _structure_layout(layout_key):
+    """
+    Work out the article layout from (tag, order, id, parent_id) tuples
+    Keywords are bucketed by tag in one pass and H3s are grouped by parent_id,
+    so each H2 looks up its H3s directly. Returns list positions, not keywords:
+    (h1 positions, ((h2 position, h3 positions), ...))
+    """
+    buckets = {'H1': [], 'H2': [], 'H3': []}
+    for position, (tag, order, _, _) in enumerate(layout_key):
+        if tag in buckets:
+            buckets[tag].append((order, position))
+    for tagged in buckets.values():
+        tagged.sort(key=itemgetter(0))
+    h3_by_parent = defaultdict(list)
+    for _, position in buckets['H3']:
+        h3_by_parent[layout_key[position][3]].append(position)
+    
+    h1_positions = tuple(position for _, position in buckets['H1'])
+    h2_layout = tuple(
+        (position, tuple(h3_by_parent[layout_key[position][2]]))
+        for _, position in buckets['H2']
+    )
+    return h1_positions, h2_layout
+
+def build_structured(keywords):
+    """
+    Build the article structure (head and body) from tagged keywords
+    The layout only depends on tags, order and parent ids, so it is memoized and
+    repeated downloads/generations over unchanged tags skip the sort and grouping.
+    Untagged keywords are left out
+    """
+    layout_key = tuple((kw['tag'], kw['order'], kw['id'], kw.get('parent_id')) for kw in keywords)
+    h1_positions, h2_layout = _structure_layout(layout_key)
+    
+    h2_entries = [
+        {
+            'keyword': str(keywords[h2_position]['keyword']),
+            'paragraphs': [],
+            'bullets': [],
+            'h3_keywords': [
+                {
+                    'keyword': str(keywords[h3_position]['keyword']),
+                    'paragraphs': [],
+                    'bullets': []
+                }
+                for h3_position in h3_positions
+            ]
+        }
+        for h2_position, h3_positions in h2_layout
+    ]
+    
+    return {
+        'head': {
+            'title': '',
+            'meta_description': ''
+        },
+        'body': {
+            'h1_keywords': [{'keyword': str(keywords[position]['keyword'])} for position in h1_positions],
+            'h2_keywords': h2_entries,
+            'faqs_html': []
+        }
+    }
+
+GEMINI_MODEL_NAME = 'gemini-1.5-pro'
+# Bump when the prompts or the expected response schema change, so cached content
+# written for the old prompts is no longer served
+PROMPT_VERSION = 1
+
 def setup_gemini():
     """Setup Gemini API"""
     try:
-        model = genai.GenerativeModel('gemini-1.5-pro')
+        model = genai.GenerativeModel(GEMINI_MODEL_NAME)
         return model
     except Exception as e:
-        print(f"❌ Error setting up Gemini AI: {e}")
+        logger.error(f"❌ Error setting up Gemini AI: {e}")
         return None
 
-def create_prompt(json_data):
-    """Create a comprehensive prompt for Gemini AI"""
+# Build the Gemini model once at startup and share it across requests
+GEMINI_MODEL = setup_gemini()
+
+# Response schemas for Gemini structured output. With these the model returns
+# plain JSON matching the article structure, so responses need no cleanup.
+class H3Content(TypedDict):
+    keyword: str
+    paragraphs: list[str]
+    bullets: list[str]
+
+class SectionContent(TypedDict):
+    keyword: str
+    paragraphs: list[str]
+    bullets: list[str]
+    h3_keywords: list[H3Content]
+
+class SectionBatchContent(TypedDict):
+    sections: list[SectionContent]
+
+class HeadFields(TypedDict):
+    title: str
+    meta_description: str
+
+class FaqsBody(TypedDict):
+    faqs_html: list[str]
+
+class HeadContent(TypedDict):
+    head: HeadFields
+    body: FaqsBody
+
+def json_generation_config(schema):
+    """
+    Generation config asking Gemini for JSON that matches schema
+    SDK versions without structured output get a plain config; extract_json then
+    pulls the JSON out of the free-form reply
+    """
+    try:
+        return genai.GenerationConfig(
+            response_mime_type='application/json',
+            response_schema=schema,
+            temperature=0.4
+        )
+    except TypeError as e:
+        logger.warning(f"⚠️ Structured output not supported by this google-generativeai version: {e}")
+        return genai.GenerationConfig(temperature=0.4)
+
+HEAD_GENERATION_CONFIG = json_generation_config(HeadContent)
+SECTION_GENERATION_CONFIG = json_generation_config(SectionContent)
+SECTION_BATCH_GENERATION_CONFIG = json_generation_config(SectionBatchContent)
+
+# Shared event loop for Gemini calls. All requests multiplex their Gemini I/O on
+# this one loop, so the async client (which is bound to the loop it was created
+# on) is reused and the semaphore bounds in-flight calls across the whole app.
+_gemini_loop = asyncio.new_event_loop()
+threading.Thread(target=_gemini_loop.run_forever, name='gemini-loop', daemon=True).start()
+_gemini_semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+
+class GeminiLimiter:
+    """
+    Sliding one-minute window over Gemini requests and their estimated input tokens
+    Callers wait until the request fits under both limits instead of running into
+    429s. Only used on the shared Gemini loop, so it needs no lock
+    """
+
+    def __init__(self, rpm, tpm):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._calls = deque()
+        self._tokens = 0
+
+    async def acquire(self, tokens):
+        tokens = min(tokens, self.tpm)
+        while True:
+            now = time.monotonic()
+            while self._calls and now - self._calls[0][0] >= 60:
+                self._tokens -= self._calls.popleft()[1]
+            if len(self._calls) < self.rpm and self._tokens + tokens <= self.tpm:
+                self._calls.append((now, tokens))
+                self._tokens += tokens
+                return
+            await asyncio.sleep(60 - (now - self._calls[0][0]))
+
+_gemini_limiter = GeminiLimiter(GEMINI_RPM, GEMINI_TPM)
+
+async def _generate_content_async(model, prompt, generation_config=None):
+    """
+    Call Gemini asynchronously, bounded by the shared semaphore, the rate limiter and a timeout
+    Rate-limit, overload and timeout errors are retried with exponential backoff and jitter
+    """
+    async with _gemini_semaphore:
+        for attempt in range(GEMINI_MAX_RETRIES):
+            # Rough estimate: about 4 characters per token
+            await _gemini_limiter.acquire(len(prompt) // 4)
+            try:
+                return await asyncio.wait_for(
+                    model.generate_content_async(prompt, generation_config=generation_config),
+                    GEMINI_TIMEOUT
+                )
+            except (ResourceExhausted, ServiceUnavailable, DeadlineExceeded, asyncio.TimeoutError) as e:
+                if attempt == GEMINI_MAX_RETRIES - 1:
+                    raise
+                delay = 2 ** attempt + random.random()
+                logger.warning(f"⚠️ Gemini call failed ({type(e).__name__}), retrying in {delay:.1f}s...")
+                await asyncio.sleep(delay)
+
+async def _generate_batch_async(model, calls, on_done=None):
+    async def run(prompt, config):
+        try:
+            return await _generate_content_async(model, prompt, config)
+        finally:
+            if on_done:
+                on_done()
+    return await asyncio.gather(*(run(prompt, config) for prompt, config in calls), return_exceptions=True)
+
+def generate_with_gemini(model, prompt, generation_config=None):
+    """Run a Gemini call on the shared event loop and wait for its response"""
+    future = asyncio.run_coroutine_threadsafe(_generate_content_async(model, prompt, generation_config), _gemini_loop)
+    return future.result()
+
+def generate_batch_with_gemini(model, calls, on_done=None):
+    """
+    Run several Gemini calls concurrently on the shared event loop
+    calls is a list of (prompt, generation_config) pairs. Returns one response per
+    call, in order, with an exception in place of any failed call. on_done, if
+    given, is called (on the loop thread) as each call finishes
+    """
+    future = asyncio.run_coroutine_threadsafe(_generate_batch_async(model, calls, on_done), _gemini_loop)
+    return future.result()
+
+class PromptCache:
+    """
+    Two-tier cache for AI generated content
+    Exact match on a SHA-256 of the canonical structured data, with an optional
+    fallback to the most similar cached structure by embedding cosine similarity.
+    Keys and similarity candidates are limited to the namespace (model and prompt
+    version), so content written by another model or older prompts is not served.
+    Entries older than ttl seconds are treated as misses when ttl is set, and are
+    deleted (with their embeddings) whenever new content is stored.
+    hits and misses only count the article lookups passed to record_lookup, so the
+    per-section lookups do not skew the article hit rate
+    """
+
+    def __init__(self, path, similarity_threshold=0, ttl=0, namespace=''):
+        self.similarity_threshold = similarity_threshold
+        self.namespace = namespace
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS prompt_cache ('
+            'key TEXT PRIMARY KEY, embedding BLOB, response TEXT NOT NULL, created_at REAL NOT NULL, namespace TEXT)'
+        )
+        # Caches created before entries were namespaced get the column added
+        columns = {name for _, name, *_ in self._conn.execute('PRAGMA table_info(prompt_cache)')}
+        if 'namespace' not in columns:
+            self._conn.execute('ALTER TABLE prompt_cache ADD COLUMN namespace TEXT')
+        self._conn.commit()
+        
+        # Keep normalized embeddings in memory for similarity search
+        self._embedding_keys = []
+        self._embeddings = np.empty((0, 0), dtype=np.float32)
+        self._expire()
+        rows = self._conn.execute(
+            'SELECT key, embedding FROM prompt_cache WHERE embedding IS NOT NULL AND namespace IS ?', (namespace,)
+        ).fetchall()
+        for key, blob in rows:
+            self._add_embedding(key, np.frombuffer(blob, dtype=np.float32))
+
+    @staticmethod
+    def canonicalize(structured_data):
+        """Serialize structured data so identical structures produce identical text"""
+        return orjson.dumps(structured_data, option=orjson.OPT_SORT_KEYS).decode('utf-8')
+
+    def make_key(self, canonical_text):
+        """Hash the canonical text together with the namespace (model and prompt version)"""
+        return hashlib.sha256(f'{self.namespace}\n{canonical_text}'.encode('utf-8')).hexdigest()
+
+    def _add_embedding(self, key, embedding):
+        norm = np.linalg.norm(embedding)
+        if not norm:
+            return
+        vector = (embedding / norm).astype(np.float32)
+        if self._embeddings.size and self._embeddings.shape[1] != vector.shape[0]:
+            return
+        self._embeddings = np.vstack([self._embeddings, vector]) if self._embeddings.size else vector[np.newaxis, :]
+        self._embedding_keys.append(key)
+
+    def _expire(self):
+        """Delete entries older than ttl and drop their embeddings, callers hold the lock"""
+        if not self.ttl:
+            return
+        oldest = time.time() - self.ttl
+        expired = {key for key, in self._conn.execute('SELECT key FROM prompt_cache WHERE created_at < ?', (oldest,))}
+        if not expired:
+            return
+        self._conn.execute('DELETE FROM prompt_cache WHERE created_at < ?', (oldest,))
+        self._conn.commit()
+        kept = [i for i, key in enumerate(self._embedding_keys) if key not in expired]
+        self._embedding_keys = [self._embedding_keys[i] for i in kept]
+        self._embeddings = self._embeddings[kept]
+
+    def get(self, key):
+        """Return the cached content for an exact key, or None"""
+        oldest = time.time() - self.ttl if self.ttl else 0
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT response FROM prompt_cache WHERE key = ? AND created_at >= ?', (key, oldest)
+            ).fetchone()
+        return orjson.loads(row[0]) if row else None
+
+    def record_lookup(self, hit):
+        """Count one article lookup towards the hit rate"""
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get_similar(self, embedding):
+        """Return the cached content of the most similar structure above the threshold, or None"""
+        with self._lock:
+            if not self._embedding_keys:
+                return None
+            vector = np.asarray(embedding, dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            if not norm or vector.shape[0] != self._embeddings.shape[1]:
+                return None
+            scores = self._embeddings @ (vector / norm)
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity_threshold:
+                return None
+            key = self._embedding_keys[best]
+        logger.info(f"🔍 Similar cached structure found (similarity {scores[best]:.3f})")
+        return self.get(key)
+
+    def set(self, key, data, embedding=None):
+        """
+        Store generated content, with its embedding when available
+        Writes are best-effort: a database error (e.g. locked by another process) is
+        logged and the content is simply not cached
+        """
+        blob = None
+        if embedding is not None:
+            embedding = np.asarray(embedding, dtype=np.float32)
+            blob = embedding.tobytes()
+        with self._lock:
+            try:
+                self._expire()
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO prompt_cache (key, embedding, response, created_at, namespace) VALUES (?, ?, ?, ?, ?)',
+                    (key, blob, orjson.dumps(data).decode('utf-8'), time.time(), self.namespace)
+                )
+                self._conn.commit()
+            except sqlite3.Error as e:
+                self._conn.rollback()
+                logger.warning(f"⚠️ Could not write to the prompt cache: {e}")
+                return
+            if embedding is not None and key not in self._embedding_keys:
+                self._add_embedding(key, embedding)
+
+def embed_for_cache(text):
+    """Embed text for similarity lookups, returns None if the embedding call fails"""
+    try:
+        return genai.embed_content(model=EMBEDDING_MODEL, content=text)['embedding']
+    except Exception as e:
+        logger.warning(f"⚠️ Could not embed content for cache lookup: {e}")
+        return None
+
+prompt_cache = PromptCache(
+    PROMPT_CACHE_PATH, PROMPT_CACHE_SIMILARITY, PROMPT_CACHE_TTL, f'{GEMINI_MODEL_NAME}:v{PROMPT_VERSION}'
+)
+
+def article_topic(structured_data):
+    """Main topic of the article: its H1 keywords, or the first H2 when there is no H1"""
+    body = structured_data['body']
+    keywords = [kw['keyword'] for kw in body['h1_keywords']] or [kw['keyword'] for kw in body['h2_keywords'][:1]]
+    return ', '.join(keywords)
+
+def create_head_prompt(topic, structured_data):
+    """Create the prompt for the article title, meta description and FAQs"""
+    outline = [h2_entry['keyword'] for h2_entry in structured_data['body']['h2_keywords']]
+    head_structure = {
+        'head': structured_data['head'],
+        'body': {
+            'faqs_html': []
+        }
+    }
     prompt = f"""
-You are an expert content writer and SEO specialist. You will receive a JSON structure for an article and need to fill it with high-quality, SEO-optimized content.
+You are an expert content writer and SEO specialist. You are writing an article about "{topic}" with these sections:
+{orjson.dumps(outline).decode('utf-8')}
+
+You will receive the JSON structure for the article's head and FAQs and need to fill it with high-quality, SEO-optimized content.
 
 CURRENT JSON STRUCTURE:
-{json.dumps(json_data, indent=2)}
+{orjson.dumps(head_structure).decode('utf-8')}
 
 Your tasks:
 
 1. **Title**: Create an SEO-friendly title tag (max 60 characters) for "head.title" field
 2. **Meta Description**: Create an SEO-friendly meta description (150-160 characters) for "head.meta_description" field
-3. **Content**: Fill in all empty "paragraphs" arrays with 50-80 word paragraphs
-4. **Bullet Points**: Fill in all empty "bullets" arrays with 3-5 relevant bullet points
-5. **FAQs**: Create 15-20 FAQs in the "body.faqs_html" array, each in HTML format with:
+3. **FAQs**: Create 15-20 FAQs in the "body.faqs_html" array, each in HTML format with:
    - Question in <h2> tags
    - Answer in <p> tags
    - You MUST generate at least 15 FAQs (20 preferred)
    - Cover a wide range of common questions about the topic
 
-CRITICAL REQUIREMENTS:
-- Keep the exact JSON structure - do not rename any keys
-- Write engaging, informative content based on the topic
-- Include relevant keywords naturally in the content
-- Make content helpful for people interested in the topic
-- Ensure all content is original and well-researched
-- FAQs should cover common questions about the topic
-- CRITICAL: You MUST generate at least 15 FAQs in the faqs_html array (20 preferred)
+Include relevant keywords naturally and keep all content original.
+"""
+    return prompt
+
+def create_section_prompt(topic, h2_entry):
+    """Create the prompt that fills one H2 section and its H3 subsections"""
+    prompt = f"""
+You are an expert content writer and SEO specialist. You are writing one section of an article about "{topic}". You will receive the JSON structure for this section and need to fill it with high-quality, SEO-optimized content.
 
-IMPORTANT: Return ONLY valid JSON. Do not include any explanations, markdown formatting, or text outside the JSON structure. The response must be parseable as valid JSON.
+CURRENT JSON STRUCTURE:
+{orjson.dumps(h2_entry).decode('utf-8')}
+
+Your tasks:
+
+1. **Content**: Fill in all empty "paragraphs" arrays with 50-80 word paragraphs
+2. **Bullet Points**: Fill in all empty "bullets" arrays with 3-5 relevant bullet points
+
+Keep every keyword unchanged. Include relevant keywords naturally and keep all content original.
 """
     return prompt
 
+def create_sections_prompt(topic, h2_entries):
+    """Create one prompt that fills several H2 sections, answered as a list in input order"""
+    numbered_sections = '\n'.join(
+        f"{i}. {orjson.dumps(h2_entry).decode('utf-8')}" for i, h2_entry in enumerate(h2_entries, 1)
+    )
+    prompt = f"""
+You are an expert content writer and SEO specialist. You are writing {len(h2_entries)} sections of an article about "{topic}". You will receive the JSON structure for each section and need to fill it with high-quality, SEO-optimized content.
+
+INPUT SECTIONS:
+{numbered_sections}
+
+Your tasks, for every section:
+
+1. **Content**: Fill in all empty "paragraphs" arrays with 50-80 word paragraphs
+2. **Bullet Points**: Fill in all empty "bullets" arrays with 3-5 relevant bullet points
+
+Return the filled sections in the "sections" array, one per input section and in the same order. Keep every keyword unchanged. Include relevant keywords naturally and keep all content original.
+"""
+    return prompt
+
+@lru_cache(maxsize=64)
 def _get_faq_status(faq_count):
     """Get status message for FAQ count"""
     if faq_count >= 20:
@@ -163,7 +696,7 @@ def generate_faq_schema(faqs_html):
     """Generate FAQ schema JSON-LD from FAQs HTML"""
     try:
         if not faqs_html or not isinstance(faqs_html, list):
-            print("⚠️ No FAQs HTML provided or invalid format")
+            logger.warning("⚠️ No FAQs HTML provided or invalid format")
             return {}
         
         # Extract questions and answers from HTML
@@ -171,26 +704,26 @@ def generate_faq_schema(faqs_html):
         for i, faq_html in enumerate(faqs_html):
             try:
                 if not isinstance(faq_html, str):
-                    print(f"⚠️ FAQ {i} is not a string, skipping")
+                    logger.warning(f"⚠️ FAQ {i} is not a string, skipping")
                     continue
                     
                 # Extract question (text between <h2> tags)
-                question_match = re.search(r'<h2[^>]*>(.*?)</h2>', faq_html, re.DOTALL | re.IGNORECASE)
+                question_match = _FAQ_QUESTION_RE.search(faq_html)
                 if not question_match:
-                    print(f"⚠️ Could not extract question from FAQ {i}")
+                    logger.warning(f"⚠️ Could not extract question from FAQ {i}")
                     continue
                     
                 # Extract answer (text between <p> tags)
-                answer_match = re.search(r'<p[^>]*>(.*?)</p>', faq_html, re.DOTALL | re.IGNORECASE)
+                answer_match = _FAQ_ANSWER_RE.search(faq_html)
                 if not answer_match:
-                    print(f"⚠️ Could not extract answer from FAQ {i}")
+                    logger.warning(f"⚠️ Could not extract answer from FAQ {i}")
                     continue
                     
                 question = question_match.group(1).strip()
                 answer = answer_match.group(1).strip()
                 
                 # Clean HTML tags from answer
-                answer = re.sub(r'<[^>]+>', '', answer)
+                answer = _HTML_TAG_RE.sub('', answer)
                 
                 if question and answer:
                     faq_items.append({
@@ -202,13 +735,13 @@ def generate_faq_schema(faqs_html):
                         }
                     })
                 else:
-                    print(f"⚠️ FAQ {i} has empty question or answer after processing")
+                    logger.warning(f"⚠️ FAQ {i} has empty question or answer after processing")
             except Exception as e:
-                print(f"⚠️ Error processing FAQ {i}: {e}")
+                logger.warning(f"⚠️ Error processing FAQ {i}: {e}")
                 continue
         
         if not faq_items:
-            print("⚠️ No valid FAQ items found")
+            logger.warning("⚠️ No valid FAQ items found")
             return {}
         
         # Create FAQ schema
@@ -218,116 +751,349 @@ def generate_faq_schema(faqs_html):
             "mainEntity": faq_items
         }
         
-        print(f"✅ Successfully generated FAQ schema with {len(faq_items)} items")
+        logger.info(f"✅ Successfully generated FAQ schema with {len(faq_items)} items")
         return faq_schema
         
     except Exception as e:
-        print(f"❌ Error in generate_faq_schema: {e}")
+        logger.error(f"❌ Error in generate_faq_schema: {e}")
         return {}
 
-def clean_json_response(response):
-    """Clean and extract JSON from AI response"""
-    import re
-    
-    if not response or not isinstance(response, str):
-        print(f"❌ Invalid response type: {type(response)}")
-        return ""
-    
-    print(f"🔍 Cleaning response of length: {len(response)}")
-    print(f"🔍 Response starts with: '{response[:100]}...'")
-    
-    # Try direct JSON parsing first
-    try:
-        json.loads(response)
-        print("✅ Direct JSON parsing successful")
-        return response
-    except json.JSONDecodeError as e:
-        print(f"⚠️ Direct JSON parsing failed: {e}")
-    
-    # Try to extract JSON from the response
-    json_match = re.search(r'\{.*\}', response, re.DOTALL)
-    if json_match:
-        extracted_json = json_match.group(0)
-        print(f"🔍 Extracted JSON length: {len(extracted_json)}")
-        print(f"🔍 Extracted JSON starts with: '{extracted_json[:100]}...'")
-        
-        # Try to fix common JSON issues
-        cleaned_json = extracted_json
-        
-        # Fix trailing commas before closing braces and brackets
-        cleaned_json = re.sub(r',(\s*[}\]])', r'\1', cleaned_json)
-        
-        # Fix trailing commas before closing quotes
-        cleaned_json = re.sub(r',(\s*")', r'\1', cleaned_json)
-        
-        # Fix trailing commas in object properties
-        cleaned_json = re.sub(r',(\s*})', r'\1', cleaned_json)
-        
-        # Fix trailing commas in arrays
-        cleaned_json = re.sub(r',(\s*\])', r'\1', cleaned_json)
-        
-        # Remove any stray characters at the end
-        cleaned_json = re.sub(r'[^\w\s\{\}\[\]",:.\-_\s]+$', '', cleaned_json)
-        
-        # Remove any trailing single quotes
-        cleaned_json = re.sub(r"'$", '', cleaned_json)
-        
-        try:
-            json.loads(cleaned_json)
-            print("✅ JSON extracted and cleaned from response")
-            return cleaned_json
-        except json.JSONDecodeError as e:
-            print(f"❌ Extracted JSON parsing failed after cleaning: {e}")
-            # Try the original extracted JSON as fallback
-            try:
-                json.loads(extracted_json)
-                print("✅ Original extracted JSON parsing successful")
-                return extracted_json
-            except json.JSONDecodeError:
-                pass
-    
-    print(f"❌ No valid JSON found in response")
-    return ""
+def extract_json(text):
+    """
+    Find the first complete JSON object in text, dropping trailing commas
+    Walks the text once, tracking brace depth and whether we are inside a string
+    (so braces and commas in string values don't count). A comma followed only by
+    whitespace before a closing brace or bracket is left out of the result.
+    Returns the object's text, or None if there is no balanced object
+    """
+    start = text.find('{')
+    if start == -1:
+        return None
+    out = []
+    depth = 0
+    in_string = False
+    escaped = False
+    pending_comma = None
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char in ' \t\r\n':
+            pass
+        else:
+            if char in '}]' and pending_comma is not None:
+                out[pending_comma] = ''
+            pending_comma = None
+            if char == '"':
+                in_string = True
+            elif char == ',':
+                pending_comma = len(out)
+            elif char == '{':
+                depth += 1
+            elif char == '}':
+                depth -= 1
+                if depth == 0:
+                    out.append(char)
+                    return ''.join(out)
+        out.append(char)
+    return None
 
 def validate_and_fix_json(json_data):
-    """Validate and fix JSON data before saving"""
-    import re
-    
-    if isinstance(json_data, str):
-        # If it's a string, try to parse it first
-        try:
-            json_data = json.loads(json_data)
-        except json.JSONDecodeError as e:
-            print(f"❌ JSON validation failed: {e}")
-            return None
+    """
+    Validate and fix JSON data before saving
+    Objects that were already parsed are valid JSON and are returned as they are;
+    only raw strings go through the cleanup and a parse
+    """
+    if not isinstance(json_data, str):
+        return json_data
     
-    # Convert back to string for cleaning
-    json_string = json.dumps(json_data, indent=2, ensure_ascii=False)
+    # Try the string as it is first
+    try:
+        return orjson.loads(json_data)
+    except orjson.JSONDecodeError as e:
+        logger.warning(f"⚠️ JSON validation failed, cleaning: {e}")
     
     # Apply comprehensive cleaning
-    cleaned_json = json_string
-    
-    # Fix trailing commas in objects
-    cleaned_json = re.sub(r',(\s*})', r'\1', cleaned_json)
+    cleaned_json = json_data
     
-    # Fix trailing commas in arrays
-    cleaned_json = re.sub(r',(\s*\])', r'\1', cleaned_json)
+    # Fix trailing commas in objects and arrays
+    cleaned_json = _TRAILING_COMMA_RE.sub(r'\1', cleaned_json)
     
     # Remove any stray characters at the end
-    cleaned_json = re.sub(r'[^\w\s\{\}\[\]",:.\-_\s]+$', '', cleaned_json)
+    cleaned_json = _TRAILING_JUNK_RE.sub('', cleaned_json)
     
     # Remove any trailing single quotes
-    cleaned_json = re.sub(r"'$", '', cleaned_json)
+    cleaned_json = _TRAILING_QUOTE_RE.sub('', cleaned_json)
     
     # Try to parse the cleaned JSON
     try:
-        validated_data = json.loads(cleaned_json)
-        print("✅ JSON validated and cleaned successfully")
+        validated_data = orjson.loads(cleaned_json)
+        logger.info("✅ JSON validated and cleaned successfully")
         return validated_data
-    except json.JSONDecodeError as e:
-        print(f"❌ JSON validation failed after cleaning: {e}")
+    except orjson.JSONDecodeError as e:
+        logger.error(f"❌ JSON validation failed after cleaning: {e}")
         return None
 
+def parse_gemini_response(response):
+    """
+    Parse the JSON object from a Gemini structured-output response
+    Returns (data, None) on success or (None, error_message) on failure
+    """
+    if isinstance(response, Exception):
+        logger.error(f"❌ Error calling Gemini API: {response}")
+        return None, f'Failed to call Gemini API: {str(response)}'
+    
+    logger.debug("🔍 Raw response from Gemini: %s", response)
+    logger.debug("🔍 Response type: %s", type(response))
+    logger.debug("🔍 Response text: %s", getattr(response, 'text', 'No text attribute'))
+    
+    if not (response and hasattr(response, 'text') and response.text and response.text.strip()):
+        # One bounded line; the full response object is only logged at DEBUG level above
+        logger.error("❌ Error: No valid response from Gemini AI: %.500r", response)
+        return None, 'No valid response from Gemini AI'
+    
+    logger.debug("🔍 Response text length: %d", len(response.text))
+    logger.debug("🔍 Response text preview: %s...", response.text[:200])
+    
+    # Structured output is plain JSON, so it parses directly
+    try:
+        data = orjson.loads(response.text)
+    except orjson.JSONDecodeError as e:
+        # Safety net: pull the JSON object out of any surrounding text
+        logger.warning(f"⚠️ Direct JSON parsing failed: {e}")
+        extracted = extract_json(response.text)
+        if extracted is None:
+            logger.error(f"❌ No valid JSON found in response: {response.text}")
+            return None, 'AI response is not valid JSON'
+        try:
+            data = orjson.loads(extracted)
+        except orjson.JSONDecodeError as e:
+            logger.error(f"❌ Error: Response is not valid JSON: {e}")
+            logger.exception(f"❌ Failed to parse: {extracted}")
+            return None, 'AI response is not valid JSON'
+        logger.info("✅ JSON extracted from response")
+    
+    if not isinstance(data, dict):
+        logger.error(f"❌ Error: Response JSON is a {type(data)}, not an object")
+        return None, 'AI response is not valid JSON'
+    
+    logger.info(f"✅ JSON parsed successfully, data keys: {list(data.keys())}")
+    return data, None
+
+def request_ai_content(model, structured_data, on_progress=None, regenerate=False):
+    """
+    Fill the article structure with Gemini
+    H2 sections are split into groups of GEMINI_SECTIONS_PER_CALL, each written by
+    its own prompt, and all of them run concurrently next to one prompt for the head
+    and FAQs. Sections already written for the same topic are taken from the prompt
+    cache and left out of the prompts. Failed calls are retried once, and the head is
+    regenerated with a stricter prompt if fewer than 15 FAQs come back
+    on_progress(done, total), if given, is called as each call finishes
+    regenerate skips the cached sections so every section is written again
+    Returns (ai_generated_data, None) on success or (None, error_message) on failure
+    """
+    topic = article_topic(structured_data)
+    sections = structured_data['body']['h2_keywords']
+    
+    # Each section is cached on its own, so regenerating after a small edit only
+    # sends the sections that changed. Groups hold positions in sections
+    section_keys = [
+        prompt_cache.make_key(PromptCache.canonicalize({'topic': topic, 'section': h2_entry}))
+        for h2_entry in sections
+    ]
+    filled_by_position = {}
+    if not regenerate:
+        for position, key in enumerate(section_keys):
+            cached = prompt_cache.get(key)
+            if cached is not None:
+                filled_by_position[position] = cached
+    if filled_by_position:
+        logger.info(f"✅ Reusing {len(filled_by_position)} of {len(sections)} sections from the cache")
+    missing = [position for position in range(len(sections)) if position not in filled_by_position]
+    groups = [missing[i:i + GEMINI_SECTIONS_PER_CALL] for i in range(0, len(missing), GEMINI_SECTIONS_PER_CALL)]
+    
+    calls = [(create_head_prompt(topic, structured_data), HEAD_GENERATION_CONFIG)]
+    for group in groups:
+        if len(group) == 1:
+            calls.append((create_section_prompt(topic, sections[group[0]]), SECTION_GENERATION_CONFIG))
+        else:
+            calls.append((create_sections_prompt(topic, [sections[position] for position in group]), SECTION_BATCH_GENERATION_CONFIG))
+    
+    def parse_call(i, response):
+        data, error = parse_gemini_response(response)
+        if error or i == 0:
+            return data, error
+        # Unwrap the sections of a batched call, checking one came back per input
+        group = groups[i - 1]
+        if len(group) == 1:
+            return [data], None
+        filled = data.get('sections')
+        if not isinstance(filled, list) or len(filled) != len(group):
+            count = len(filled) if isinstance(filled, list) else 0
+            logger.error(f"❌ Error: AI returned {count} sections for {len(group)}")
+            return None, f'AI returned {count} sections instead of {len(group)}'
+        return filled, None
+    
+    # Send to Gemini
+    logger.info(f"🔄 Sending {len(calls)} requests to Gemini AI...")
+    start_time = time.time()
+    completed = 0
+    def report_progress():
+        nonlocal completed
+        completed += 1
+        on_progress(completed, len(calls))
+    responses = generate_batch_with_gemini(model, calls, report_progress if on_progress else None)
+    processing_time = time.time() - start_time
+    logger.info(f"✅ Gemini API calls completed in {processing_time:.1f}s")
+    
+    results = [parse_call(i, response) for i, response in enumerate(responses)]
+    
+    # Retry only the calls that failed
+    failed = [i for i, (_, error) in enumerate(results) if error]
+    if failed:
+        logger.warning(f"⚠️ Retrying {len(failed)} failed Gemini requests...")
+        retried = generate_batch_with_gemini(model, [calls[i] for i in failed])
+        for i, response in zip(failed, retried):
+            results[i] = parse_call(i, response)
+    
+    # Cache every section that was written before reporting a failed one,
+    # so trying again only resends the sections that are still missing
+    section_error = None
+    for group, (group_sections, error) in zip(groups, results[1:]):
+        if error:
+            if section_error is None:
+                names = ', '.join(sections[position]['keyword'] for position in group)
+                section_error = f"{error} (section '{names}')"
+            continue
+        for position, filled in zip(group, group_sections):
+            filled_by_position[position] = filled
+            # A reordered batch must not store one section's content under another's key
+            if isinstance(filled, dict) and filled.get('keyword') == sections[position]['keyword']:
+                prompt_cache.set(section_keys[position], filled)
+            else:
+                logger.warning(f"⚠️ Not caching section '{sections[position]['keyword']}': AI returned a different keyword")
+    if section_error:
+        return None, section_error
+    filled_sections = [filled_by_position[position] for position in range(len(sections))]
+    
+    head_data, error = results[0]
+    if error:
+        return None, error
+    
+    # Validate FAQ count
+    faqs_html = head_data.get('body', {}).get('faqs_html', [])
+    faqs_count = len(faqs_html)
+    if faqs_count < 15:
+        logger.warning(f"⚠️ Warning: Generated {faqs_count} FAQs (minimum 15 required). Regenerating...")
+        # Try to regenerate with a more explicit prompt
+        enhanced_prompt = calls[0][0] + "\n\nCRITICAL REMINDER: You MUST generate AT LEAST 15 FAQs in the faqs_html array. Current count: " + str(faqs_count) + ". Please regenerate with at least 15 FAQs (20 preferred)."
+        try:
+            regenerated_data, error = parse_gemini_response(generate_with_gemini(model, enhanced_prompt, HEAD_GENERATION_CONFIG))
+            if error:
+                logger.warning("⚠️ Regeneration failed, using original result")
+            else:
+                head_data = regenerated_data
+                faqs_html = head_data.get('body', {}).get('faqs_html', [])
+                logger.info(f"✅ Regenerated with {len(faqs_html)} FAQs")
+        except Exception as e:
+            logger.warning(f"⚠️ Regeneration failed: {e}, using original result")
+    elif faqs_count < 20:
+        logger.info(f"✅ Generated {faqs_count} FAQs (acceptable range: 15-20)")
+    else:
+        logger.info(f"✅ Generated {faqs_count} FAQs (perfect!)")
+    
+    ai_generated_data = {
+        'head': head_data.get('head', {}),
+        'body': {
+            'h1_keywords': structured_data['body']['h1_keywords'],
+            'h2_keywords': filled_sections,
+            'faqs_html': faqs_html
+        }
+    }
+    return ai_generated_data, None
+
+def _to_float(value):
+    """Parse a CSV number, treating missing or invalid values as 0"""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return number if math.isfinite(number) else 0.0
+
+def read_keywords_csv(stream):
+    """
+    Parse a semicolon separated keyword CSV into keyword records in one pass
+    Rows without a numeric volume are skipped and only the first row of each keyword is kept
+    """
+    reader = csv.reader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''), delimiter=';')
+    header = [name.strip() for name in next(reader, ())]
+    for column in ('Keyword', 'Volume'):
+        if column not in header:
+            raise KeyError(column)
+    
+    # Rows are plain lists; the five columns we use are pulled out by position, and
+    # missing optional columns point at a blank cell padded onto the end of each row
+    width = len(header) + 1
+    columns = itemgetter(*(
+        header.index(name) if name in header else width - 1
+        for name in ('Keyword', 'Volume', 'Intent', 'Keyword Difficulty', 'CPC (CAD)')
+    ))
+    
+    keywords_data = []
+    seen = set()
+    for row in reader:
+        if len(row) < width:
+            row += [''] * (width - len(row))
+        keyword, volume, intent, difficulty, cpc = columns(row)
+        try:
+            volume = int(float(volume))
+        except (ValueError, OverflowError):
+            continue
+        if not keyword or keyword in seen:
+            continue
+        seen.add(keyword)
+        keywords_data.append({
+            'id': len(keywords_data),
+            'keyword': keyword,
+            'volume': volume,
+            'intent': intent,
+            'difficulty': _to_float(difficulty),
+            'cpc': _to_float(cpc),
+            'tag': '',  # H1, H2, H3, or empty
+            'order': len(keywords_data)
+        })
+    return keywords_data
+
+# Parsed keyword lists of recent uploads, keyed by the SHA-256 of the file body
+UPLOAD_CACHE_SIZE = 16
+_upload_cache = OrderedDict()
+_upload_cache_lock = threading.Lock()
+
+def parse_keywords_upload(body):
+    """
+    Parse an uploaded keyword CSV, reusing the result for byte-identical re-uploads
+    Returns fresh copies of the records so each session can edit its own
+    """
+    digest = hashlib.sha256(body).digest()
+    with _upload_cache_lock:
+        keywords_data = _upload_cache.get(digest)
+        if keywords_data is not None:
+            _upload_cache.move_to_end(digest)
+    if keywords_data is None:
+        keywords_data = read_keywords_csv(io.BytesIO(body))
+        with _upload_cache_lock:
+            _upload_cache[digest] = keywords_data
+            if len(_upload_cache) > UPLOAD_CACHE_SIZE:
+                _upload_cache.popitem(last=False)
+    else:
+        logger.info("✅ Reusing parsed keywords from an identical upload")
+    return [dict(kw) for kw in keywords_data]
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -338,77 +1104,29 @@ def test():
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    global current_data
-    
-    print("Upload endpoint called")  # Debug print
-    print(f"Request method: {request.method}")  # Debug print
-    print(f"Request files: {request.files}")  # Debug print
-    print(f"Request form: {request.form}")  # Debug print
+    logger.debug("Upload endpoint called")
+    logger.debug("Request method: %s", request.method)
+    logger.debug("Request files: %s", request.files)
+    logger.debug("Request form: %s", request.form)
     
     if 'file' not in request.files:
-        print("No file in request.files")  # Debug print
+        logger.debug("No file in request.files")
         return jsonify({'error': 'No file uploaded'}), 400
     
     file = request.files['file']
-    print(f"File received: {file.filename}")  # Debug print
-    print(f"File content type: {file.content_type}")  # Debug print
+    logger.debug("File received: %s", file.filename)
+    logger.debug("File content type: %s", file.content_type)
     
     if file.filename == '':
-        print("Empty filename")  # Debug print
+        logger.debug("Empty filename")
         return jsonify({'error': 'No file selected'}), 400
     
     if file and file.filename.endswith('.csv'):
         try:
             # Read CSV with semicolon delimiter
-            df = pd.read_csv(file, delimiter=';', encoding='utf-8')
-            
-            # Clean column names
-            df.columns = df.columns.str.strip()
-            
-            # Convert volume to numeric, handling any non-numeric values
-            df['Volume'] = pd.to_numeric(df['Volume'], errors='coerce')
-            
-            # Remove rows with NaN volume
-            df = df.dropna(subset=['Volume'])
-            
-            # Convert volume to integer
-            df['Volume'] = df['Volume'].astype(int)
-            
-            # Remove exact duplicates
-            df = df.drop_duplicates(subset=['Keyword'])
-            
-            # Convert to list of dictionaries
-            keywords_data = []
-            for _, row in df.iterrows():
-                # Handle NaN values by converting them to None or 0
-                difficulty = row.get('Keyword Difficulty', 0)
-                if pd.isna(difficulty):
-                    difficulty = 0
-                else:
-                    difficulty = float(difficulty)
-                
-                cpc = row.get('CPC (CAD)', 0)
-                if pd.isna(cpc):
-                    cpc = 0.0
-                else:
-                    cpc = float(cpc)
-                
-                intent = row.get('Intent', '')
-                if pd.isna(intent):
-                    intent = ''
-                
-                keywords_data.append({
-                    'id': len(keywords_data),
-                    'keyword': str(row['Keyword']),
-                    'volume': int(row['Volume']),
-                    'intent': str(intent),
-                    'difficulty': difficulty,
-                    'cpc': cpc,
-                    'tag': '',  # H1, H2, H3, or empty
-                    'order': len(keywords_data)
-                })
+            keywords_data = parse_keywords_upload(file.read())
             
-            current_data = keywords_data
+            keyword_store.set(get_session_id(), keywords_data)
             
             return jsonify({
                 'success': True,
@@ -417,19 +1135,16 @@ def upload_file():
             })
             
         except Exception as e:
-            print(f"Error processing file: {str(e)}")  # Debug print
-            import traceback
-            traceback.print_exc()  # Print full error traceback
+            logger.exception(f"Error processing file: {e}")
             return jsonify({'error': f'Error processing file: {str(e)}'}), 400
     
     return jsonify({'error': 'Invalid file format. Please upload a CSV file.'}), 400
 
 @app.route('/filter', methods=['POST'])
 def filter_keywords():
-    global current_data
-    
-    if current_data is None:
-        return jsonify({'error': 'No data loaded'}), 400
+    sid = get_session_id()
+    if not keyword_store.has_data(sid):
+        return _static_error(_NO_DATA_JSON, 400)
     
     data = request.get_json()
     min_volume = data.get('min_volume', 400)
@@ -439,12 +1154,8 @@ def filter_keywords():
     except ValueError:
         return jsonify({'error': 'Invalid volume threshold'}), 400
     
-    # Filter keywords by volume
-    filtered_data = [kw for kw in current_data if kw['volume'] >= min_volume]
-    
-    # Update order
-    for i, kw in enumerate(filtered_data):
-        kw['order'] = i
+    # Filter keywords by volume and update their order
+    filtered_data = keyword_store.filter(sid, min_volume)
     
     return jsonify({
         'success': True,
@@ -454,121 +1165,90 @@ def filter_keywords():
 
 @app.route('/update_tags', methods=['POST'])
 def update_tags():
-    global current_data
-    
-    if current_data is None:
-        return jsonify({'error': 'No data loaded'}), 400
+    sid = get_session_id()
+    if not keyword_store.has_data(sid):
+        return _static_error(_NO_DATA_JSON, 400)
     
     data = request.get_json()
     updates = data.get('updates', [])
     
-    for update in updates:
-        keyword_id = update.get('id')
-        new_tag = update.get('tag', '')
-        
-        # Find and update the keyword
-        for kw in current_data:
-            if kw['id'] == keyword_id:
-                kw['tag'] = new_tag
-                break
+    keyword_store.update_tags(sid, updates)
     
     return jsonify({'success': True, 'message': 'Tags updated successfully'})
 
 @app.route('/remove_keyword', methods=['POST'])
 def remove_keyword():
-    global current_data
-    
-    if current_data is None:
-        return jsonify({'error': 'No data loaded'}), 400
+    sid = get_session_id()
+    if not keyword_store.has_data(sid):
+        return _static_error(_NO_DATA_JSON, 400)
     
     data = request.get_json()
     keyword_id = data.get('id')
     
-    # Remove the keyword
-    current_data = [kw for kw in current_data if kw['id'] != keyword_id]
-    
-    # Update order
-    for i, kw in enumerate(current_data):
-        kw['order'] = i
+    # Remove the keyword and update order
+    keyword_store.remove(sid, keyword_id)
     
     return jsonify({'success': True, 'message': 'Keyword removed successfully'})
 
 @app.route('/reorder', methods=['POST'])
 def reorder_keywords():
-    global current_data
-    
-    if current_data is None:
-        return jsonify({'error': 'No data loaded'}), 400
+    sid = get_session_id()
+    if not keyword_store.has_data(sid):
+        return _static_error(_NO_DATA_JSON, 400)
     
     data = request.get_json()
     new_order = data.get('order', [])
     
-    # Create a mapping of id to keyword
-    keyword_map = {kw['id']: kw for kw in current_data}
-    
     # Reorder based on the new order
-    reordered_data = []
-    for i, keyword_id in enumerate(new_order):
-        if keyword_id in keyword_map:
-            keyword_map[keyword_id]['order'] = i
-            reordered_data.append(keyword_map[keyword_id])
-    
-    current_data = reordered_data
+    keyword_store.reorder(sid, new_order)
     
     return jsonify({'success': True, 'message': 'Keywords reordered successfully'})
 
 @app.route('/update_data', methods=['POST'])
 def update_data():
-    global current_data
-    
     data = request.get_json()
-    new_data = data.get('data', [])
+    new_data = data.get('data', []) if isinstance(data, dict) else []
     
-    print(f"Updating backend data: {len(new_data)} keywords")  # Debug print
+    # The keyword store indexes records by id, so reject anything it cannot index
+    if not isinstance(new_data, list) or not all(isinstance(kw, dict) and 'id' in kw for kw in new_data):
+        return jsonify({'error': 'Data must be a list of keywords with an id'}), 400
+    
+    logger.debug("Updating backend data: %d keywords", len(new_data))
     
     if new_data:
-        current_data = new_data
-        print(f"Backend data updated successfully. Current data has {len(current_data)} keywords")  # Debug print
+        keyword_store.set(get_session_id(), new_data)
+        logger.debug("Backend data updated successfully. Current data has %d keywords", len(new_data))
         return jsonify({'success': True, 'message': 'Data updated successfully'})
     else:
-        print("No data provided to update")  # Debug print
+        logger.debug("No data provided to update")
         return jsonify({'error': 'No data provided'}), 400
 
 @app.route('/download', methods=['POST'])
 def download_json():
-    global current_data
-    
+    current_data = keyword_store.get(get_session_id())
     if current_data is None:
-        return jsonify({'error': 'No data loaded'}), 400
+        return _static_error(_NO_DATA_JSON, 400)
     
     # Get the latest data from the request if provided
     data = request.get_json()
     identifier = {}
     if data and 'data' in data:
         download_data = data['data']
-        print(f"Using data from request: {len(download_data)} keywords")  # Debug print
+        logger.debug("Using data from request: %d keywords", len(download_data))
         # Get identifier if provided
         identifier = data.get('identifier', {})
-        # Validate identifier if it contains handle and tags
-        if isinstance(identifier, dict):
-            if 'handle' in identifier:
-                is_valid, result = validate_handle(identifier['handle'])
-                if not is_valid:
-                    return jsonify({'error': f'Invalid handle: {result}'}), 400
-                identifier['handle'] = result  # Use validated handle
-            
-            if 'tags' in identifier:
-                # Get the validated handle to sync tags
-                validated_handle = identifier.get('handle', '')
-                is_valid, result = validate_tags(identifier['tags'], validated_handle)
-                if not is_valid:
-                    return jsonify({'error': f'Invalid tags: {result}'}), 400
-                identifier['tags'] = result  # Use validated tags
+        error = validate_identifier(identifier)
+        if error:
+            return jsonify({'error': error}), 400
     else:
         download_data = current_data
-        print(f"Using current_data from backend: {len(download_data)} keywords")  # Debug print
+        logger.debug("Using current_data from backend: %d keywords", len(download_data))
     
-    print(f"Downloading {len(download_data)} keywords")  # Debug print
+    logger.debug("Downloading %d keywords", len(download_data))
+    
+    # Create structured JSON data (exclude untagged keywords)
+    structured_data = build_structured(download_data)
+    h1_keywords = structured_data['body']['h1_keywords']
     
     # Create filename with handle if available
     filename = 'keyword_hierarchy'
@@ -576,110 +1256,298 @@ def download_json():
     # Use handle from identifier if available and valid
     if identifier and isinstance(identifier, dict) and 'handle' in identifier:
         filename = identifier['handle']
-    else:
-        # Fallback to H1 keyword
-        h1_keywords = [kw for kw in download_data if kw['tag'] == 'H1']
-        if h1_keywords:
-            # Use the first H1 keyword as filename (clean it for filesystem)
-            h1_keyword = h1_keywords[0]['keyword']
-            # Clean filename: remove special chars, replace spaces with underscores
-            clean_filename = re.sub(r'[^\w\s-]', '', h1_keyword)
-            clean_filename = re.sub(r'[-\s]+', '_', clean_filename)
-            filename = clean_filename.lower()
-    
-    # Create structured JSON data (exclude untagged keywords)
-    structured_data = {
-        'head': {
-            'title': '',
-            'meta_description': ''
-        },
-        'body': {
-            'h1_keywords': [],
-            'h2_keywords': [],
-            'faqs_html': []
-        },
-        'script': {
-            'faq_schema': {}
-        }
+    elif h1_keywords:
+        # Fallback to the first H1 keyword (clean it for filesystem)
+        h1_keyword = h1_keywords[0]['keyword']
+        filename = keyword_to_filename(h1_keyword)
+    
+    # build_structured returns head and body in order, so adding script and then the
+    # identifier already gives the required key order (there is no hero or images here)
+    structured_data['script'] = {
+        'faq_schema': {}
     }
     
     # Add identifier if provided
     if identifier:
         structured_data['identifier'] = identifier
     
-    # Add H1 keywords first (main topic)
-    h1_keywords = [kw for kw in download_data if kw['tag'] == 'H1']
-    h1_keywords.sort(key=lambda x: x['order'])
-    for kw in h1_keywords:
-        structured_data['body']['h1_keywords'].append({
-            'keyword': str(kw['keyword'])
-        })
-    
-    # Add H2 keywords with their related H3 keywords
-    h2_keywords = [kw for kw in download_data if kw['tag'] == 'H2']
-    h3_keywords = [kw for kw in download_data if kw['tag'] == 'H3']
-    
-    h2_keywords.sort(key=lambda x: x['order'])
-    h3_keywords.sort(key=lambda x: x['order'])
-    
-    # Group H3 keywords under their parent H2 keywords
-    for h2_kw in h2_keywords:
-        h2_entry = {
-            'keyword': str(h2_kw['keyword']),
-            'paragraphs': [],
-            'bullets': [],
-            'h3_keywords': []
+    # Send the JSON straight from memory
+    payload = orjson.dumps(structured_data, option=orjson.OPT_INDENT_2)
+    return Response(
+        payload,
+        mimetype='application/json',
+        headers={'Content-Disposition': f"attachment; filename*=UTF-8''{quote(f'{filename}_hierarchy.json')}"}
+    )
+
+# Generated articles are written to ARTICLES_DIR by a background thread, and the
+# most recent ones are kept in memory so /download_generated never waits on the disk.
+# Defaults to D:/articles/nails on Windows and an articles folder next to app.py elsewhere.
+# The path is made absolute so writes and send_file resolve to the same directory
+ARTICLES_DIR = os.path.abspath(
+    os.getenv('ARTICLES_DIR') or ('D:/articles/nails' if os.name == 'nt' else os.path.join(app.root_path, 'articles'))
+)
+# Created once here; if that fails, each write fails and is reported by /download_generated
+try:
+    os.makedirs(ARTICLES_DIR, exist_ok=True)
+except OSError as e:
+    logger.error(f"❌ Could not create articles directory {ARTICLES_DIR}: {e}")
+GENERATED_CACHE_SIZE = 32
+_article_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='article-writer')
+_generated_articles = OrderedDict()
+# Articles whose disk write failed, so /download_generated can say so once they leave memory
+_failed_article_writes = OrderedDict()
+_generated_articles_lock = threading.Lock()
+
+def _write_article(path, payload):
+    try:
+        Path(path).write_bytes(payload)
+        logger.info(f"✅ Content saved to: {path}")
+    except Exception as e:
+        logger.error(f"❌ Error saving file {path}: {e}")
+        with _generated_articles_lock:
+            _failed_article_writes[os.path.basename(path)] = str(e)
+            if len(_failed_article_writes) > GENERATED_CACHE_SIZE:
+                _failed_article_writes.popitem(last=False)
+
+def save_generated_article(filename, payload):
+    """
+    Keep a generated article in memory for download and queue its write to ARTICLES_DIR
+    Returns the path the article will be written to; a failed write is logged and
+    reported by /download_generated once the article is no longer in memory
+    """
+    with _generated_articles_lock:
+        _generated_articles[filename] = payload
+        if len(_generated_articles) > GENERATED_CACHE_SIZE:
+            _generated_articles.popitem(last=False)
+    output_path = os.path.join(ARTICLES_DIR, filename)
+    _article_writer.submit(_write_article, output_path, payload)
+    return output_path
+
+def _section_outline(h2_entry):
+    """The H2 keyword and H3 keywords a section is written for, without its content"""
+    return h2_entry.get('keyword'), tuple(h3_entry.get('keyword') for h3_entry in h2_entry.get('h3_keywords') or ())
+
+def reuse_similar_article(similar, structured_data):
+    """
+    Fit a cached article of a similar structure to this one
+    It is only reused when the H1 keywords are the same and every H2 section (with
+    its H3s) has a written counterpart, so the keywords always match structured_data
+    Returns the article, or None when the cached one does not cover this structure
+    """
+    body = similar.get('body') or {}
+    h1_keywords = structured_data['body']['h1_keywords']
+    if [kw.get('keyword') for kw in body.get('h1_keywords') or ()] != [kw['keyword'] for kw in h1_keywords]:
+        return None
+    written = {_section_outline(h2_entry): h2_entry for h2_entry in body.get('h2_keywords') or ()}
+    sections = []
+    for h2_entry in structured_data['body']['h2_keywords']:
+        filled = written.get(_section_outline(h2_entry))
+        if filled is None:
+            return None
+        sections.append(filled)
+    return {
+        'head': similar.get('head', {}),
+        'body': {
+            'h1_keywords': h1_keywords,
+            'h2_keywords': sections,
+            'faqs_html': body.get('faqs_html', [])
         }
+    }
+
+def generate_article(model, structured_data, identifier, hero, images_data, on_progress=None, regenerate=False):
+    """
+    Generate, assemble and save the article for /generate_content
+    regenerate skips the cached content and writes the article again
+    Returns (response_data, status_code)
+    """
+    try:
+        # Reuse content generated earlier for the same (or a very similar) structure
+        start_time = time.time()
+        cache_text = PromptCache.canonicalize(structured_data)
+        cache_key = prompt_cache.make_key(cache_text)
+        cache_embedding = None
+        ai_generated_data = None if regenerate else prompt_cache.get(cache_key)
+        if ai_generated_data is None and prompt_cache.similarity_threshold:
+            cache_embedding = embed_for_cache(cache_text)
+            if cache_embedding is not None and not regenerate:
+                similar = prompt_cache.get_similar(cache_embedding)
+                if similar is not None:
+                    ai_generated_data = reuse_similar_article(similar, structured_data)
         
-        # Find H3 keywords that belong to this H2 using parent_id
-        for h3_kw in h3_keywords:
-            if h3_kw.get('parent_id') == h2_kw['id']:
-                h2_entry['h3_keywords'].append({
-                    'keyword': str(h3_kw['keyword']),
-                    'paragraphs': [],
-                    'bullets': []
-                })
+        if not regenerate:
+            prompt_cache.record_lookup(ai_generated_data is not None)
         
-        structured_data['body']['h2_keywords'].append(h2_entry)
-    
-    # Reorder keys to match required structure: hero, head, body, images, script, identifier
-    ordered_data = {}
-    if 'hero' in structured_data:
-        ordered_data['hero'] = structured_data['hero']
-    if 'head' in structured_data:
-        ordered_data['head'] = structured_data['head']
-    if 'body' in structured_data:
-        ordered_data['body'] = structured_data['body']
-    if 'images' in structured_data:
-        ordered_data['images'] = structured_data['images']
-    if 'script' in structured_data:
-        ordered_data['script'] = structured_data['script']
-    if 'identifier' in structured_data:
-        ordered_data['identifier'] = structured_data['identifier']
-    
-    # Create temporary file
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False, encoding='utf-8') as f:
-        json.dump(ordered_data, f, indent=2, ensure_ascii=False)
-        temp_file = f.name
-    
-    return send_file(
-        temp_file,
-        as_attachment=True,
-        download_name=f'{filename}_hierarchy.json',
-        mimetype='application/json'
-    )
+        if ai_generated_data is not None:
+            logger.info("✅ Using cached content for this keyword structure")
+        else:
+            ai_generated_data, error = request_ai_content(model, structured_data, on_progress, regenerate)
+            if error:
+                return {'error': error}, 500
+            # Only cache complete results so short FAQ lists get another chance next time
+            if len(ai_generated_data.get('body', {}).get('faqs_html', [])) >= 15:
+                prompt_cache.set(cache_key, ai_generated_data, cache_embedding)
+        processing_time = time.time() - start_time
+        lookups = prompt_cache.hits + prompt_cache.misses
+        if lookups:
+            logger.info(f"📊 Prompt cache hit rate: {prompt_cache.hits}/{lookups} articles ({prompt_cache.hits / lookups:.0%})")
+        
+        # Add identifier to the final output if provided
+        if identifier:
+            ai_generated_data['identifier'] = identifier
+        
+        # Add hero section manually (not generated by AI)
+        ai_generated_data['hero'] = hero
+        
+        # Add images field manually (not generated by AI)
+        ai_generated_data['images'] = images_data
+        
+        # Validate and fix JSON before saving
+        validated_data = validate_and_fix_json(ai_generated_data)
+        if validated_data is None:
+            logger.error("❌ Failed to validate JSON data")
+            return {'error': 'Failed to validate JSON data'}, 500
+        
+        ai_generated_data = validated_data
+        
+        # Generate FAQ schema for script field
+        try:
+            faq_schema = generate_faq_schema(ai_generated_data.get('body', {}).get('faqs_html', []))
+            ai_generated_data['script'] = {
+                'faq_schema': faq_schema
+            }
+        except Exception as e:
+            logger.warning(f"⚠️ Warning: Error generating FAQ schema: {e}")
+            # Provide empty schema as fallback
+            ai_generated_data['script'] = {
+                'faq_schema': {}
+            }
+        
+        # Reorder keys to match required structure: hero, head, body, images, script, identifier
+        ordered_data = {}
+        if 'hero' in ai_generated_data:
+            ordered_data['hero'] = ai_generated_data['hero']
+        if 'head' in ai_generated_data:
+            ordered_data['head'] = ai_generated_data['head']
+        if 'body' in ai_generated_data:
+            ordered_data['body'] = ai_generated_data['body']
+        if 'images' in ai_generated_data:
+            ordered_data['images'] = ai_generated_data['images']
+        if 'script' in ai_generated_data:
+            ordered_data['script'] = ai_generated_data['script']
+        if 'identifier' in ai_generated_data:
+            ordered_data['identifier'] = ai_generated_data['identifier']
+        
+        # Create output filename with handle
+        h1_keywords = structured_data['body']['h1_keywords']
+        filename = 'keyword_content'
+        
+        # Use handle from identifier if available (the route already validated it)
+        if identifier and isinstance(identifier, dict) and 'handle' in identifier:
+            filename = identifier['handle']
+        elif h1_keywords:
+            # Fallback to the first H1 keyword (clean it for filesystem)
+            h1_keyword = h1_keywords[0]['keyword']
+            filename = keyword_to_filename(h1_keyword)
+        
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output_filename = f'{filename}_filled_{timestamp}.json'
+        
+        # Save the result to the articles directory (written in the background)
+        output_path = save_generated_article(output_filename, orjson.dumps(ordered_data, option=orjson.OPT_INDENT_2))
+        
+        logger.info(f"✅ Content generated, saving to: {output_path}")
+        
+        # Create response data
+        head = ordered_data.get('head') or {}
+        hero_section = ordered_data.get('hero') or {}
+        body = ordered_data.get('body') or {}
+        faq_schema = (ordered_data.get('script') or {}).get('faq_schema')
+        faqs_count = len(body.get('faqs_html') or ())
+        response_data = {
+            'success': True,
+            'message': f'Content generated successfully in {processing_time:.1f}s',
+            'filename': output_filename,
+            'file_path': output_path,
+            'summary': {
+                'title': head.get('title', 'Not provided'),
+                'meta_description': head.get('meta_description', 'Not provided'),
+                'hero_tagline': hero_section.get('tagline', 'Not provided'),
+                'hero_cta': hero_section.get('cta_text', 'Not provided'),
+                'hero_cta_link': hero_section.get('cta_link', 'Not provided'),
+                'h2_sections': len(body.get('h2_keywords') or ()),
+                'faqs_generated': faqs_count,
+                'faqs_status': _get_faq_status(faqs_count),
+                'images_count': len(ordered_data.get('images') or ()),
+                'script_faq_schema': '✅ FAQ Schema generated' if faq_schema and faq_schema.get('mainEntity') else '❌ No FAQ Schema'
+            }
+        }
+        
+        logger.debug("✅ Response data prepared: %s", response_data)
+        return response_data, 200
+    except Exception as e:
+        logger.exception(f"❌ Error generating content: {e}")
+        return {'error': f'Error generating content: {str(e)}'}, 500
+
+def stream_generate_article(model, structured_data, identifier, hero, images_data, regenerate=False):
+    """
+    Run generate_article in a worker thread and relay it as server-sent events
+    Yields a 'progress' event as each Gemini call finishes, then one 'result' event
+    with the body /generate_content would return as JSON plus its status code
+    """
+    events = queue.Queue()
+    
+    def on_progress(done, total):
+        events.put(('progress', {'done': done, 'total': total}))
+    
+    def worker():
+        response_data, status = generate_article(model, structured_data, identifier, hero, images_data, on_progress, regenerate)
+        events.put(('result', {**response_data, 'status': status}))
+    
+    threading.Thread(target=worker, name='generate-article', daemon=True).start()
+    while True:
+        event, payload = events.get()
+        yield f"event: {event}\ndata: {orjson.dumps(payload).decode('utf-8')}\n\n"
+        if event == 'result':
+            break
+
+# Generations started with "Prefer: respond-async" run in the background and are polled
+# at /generation_status/<job_id>. Job state is kept next to the keyword data, so with
+# KEYWORD_STORE_PATH any server process can answer the poll. Jobs are dropped an hour
+# after their last update
+GENERATION_JOB_TTL = 3600
+generation_jobs = (
+    SqliteJobStore(KEYWORD_STORE_PATH, GENERATION_JOB_TTL) if KEYWORD_STORE_PATH
+    else MemoryJobStore(GENERATION_JOB_TTL)
+)
+
+def start_generation_job(model, structured_data, identifier, hero, images_data, regenerate=False):
+    """Run generate_article in a background thread and return the id of the job to poll"""
+    job_id = uuid.uuid4().hex
+    job = {'state': 'running', 'done': 0, 'total': 0}
+    generation_jobs.set(job_id, job)
+    
+    def on_progress(done, total):
+        job.update(done=done, total=total)
+        generation_jobs.set(job_id, job)
+    
+    def worker():
+        response_data, status = generate_article(model, structured_data, identifier, hero, images_data, on_progress, regenerate)
+        job.update(state='finished', result={**response_data, 'status': status})
+        generation_jobs.set(job_id, job)
+    
+    threading.Thread(target=worker, name='generate-article', daemon=True).start()
+    return job_id
 
 @app.route('/generate_content', methods=['POST'])
 def generate_content():
-    global current_data
-    
+    current_data = keyword_store.get(get_session_id())
     if current_data is None:
-        return jsonify({'error': 'No data loaded'}), 400
+        return _static_error(_NO_DATA_JSON, 400)
     
     # Get the latest data from the request if provided
     data = request.get_json()
-    print(f"🔍 Received data type: {type(data)}")
-    print(f"🔍 Received data: {data}")
+    logger.debug("🔍 Received data type: %s", type(data))
+    logger.debug("🔍 Received data: %s", data)
     
     # Get hero section data from frontend
     hero_data = data.get('hero', {}) if data else {}
@@ -692,6 +1560,9 @@ def generate_content():
     # Get images data from frontend (Cloudinary URLs with alt text)
     images_data = data.get('images', []) if data else []
     
+    # "regenerate": true writes the article again instead of reusing cached content
+    regenerate = bool(data and data.get('regenerate'))
+    
     # Get handle for consistent image naming
     handle = ''
     if data and 'identifier' in data and isinstance(data['identifier'], dict):
@@ -735,25 +1606,10 @@ def generate_content():
     
     if data and 'data' in data:
         json_data = data['data']
-        print(f"🔍 json_data type: {type(json_data)}")
-        print(f"🔍 json_data: {json_data}")
+        logger.debug("🔍 json_data type: %s", type(json_data))
+        logger.debug("🔍 json_data: %s", json_data)
         # Get identifier if provided
         identifier = data.get('identifier', {})
-        # Validate identifier if it contains handle and tags
-        if isinstance(identifier, dict):
-            if 'handle' in identifier:
-                is_valid, result = validate_handle(identifier['handle'])
-                if not is_valid:
-                    return jsonify({'error': f'Invalid handle: {result}'}), 400
-                identifier['handle'] = result  # Use validated handle
-            
-            if 'tags' in identifier:
-                # Get the validated handle to sync tags
-                validated_handle = identifier.get('handle', '')
-                is_valid, result = validate_tags(identifier['tags'], validated_handle)
-                if not is_valid:
-                    return jsonify({'error': f'Invalid tags: {result}'}), 400
-                identifier['tags'] = result  # Use validated tags
     else:
         json_data = current_data
         identifier = {}
@@ -762,334 +1618,129 @@ def generate_content():
     if isinstance(json_data, dict) and 'data' in json_data:
         # Extract the actual keywords list from the nested structure
         keywords_list = json_data['data']
-        # Update identifier if it's in the nested structure
+        # A nested identifier takes the place of the top-level one
         if 'identifier' in json_data:
             identifier = json_data['identifier']
-            # Validate identifier if it contains handle and tags
-            if isinstance(identifier, dict):
-                if 'handle' in identifier:
-                    is_valid, result = validate_handle(identifier['handle'])
-                    if not is_valid:
-                        return jsonify({'error': f'Invalid handle: {result}'}), 400
-                    identifier['handle'] = result  # Use validated handle
-                
-                if 'tags' in identifier:
-                    # Get the validated handle to sync tags
-                    validated_handle = identifier.get('handle', '')
-                    is_valid, result = validate_tags(identifier['tags'], validated_handle)
-                    if not is_valid:
-                        return jsonify({'error': f'Invalid tags: {result}'}), 400
-                    identifier['tags'] = result  # Use validated tags
         json_data = keywords_list
-        print(f"🔍 Extracted keywords list type: {type(json_data)}")
-        print(f"🔍 Extracted keywords list: {json_data}")
+        logger.debug("🔍 Extracted keywords list type: %s", type(json_data))
+        logger.debug("🔍 Extracted keywords list: %s", json_data)
+    
+    # Validate the identifier once, whichever level it came from
+    error = validate_identifier(identifier)
+    if error:
+        return jsonify({'error': error}), 400
     
     # Ensure json_data is a list
     if isinstance(json_data, str):
         try:
-            json_data = json.loads(json_data)
-        except json.JSONDecodeError as e:
-            print(f"❌ Error parsing JSON data: {e}")
+            json_data = orjson.loads(json_data)
+        except orjson.JSONDecodeError as e:
+            logger.error(f"❌ Error parsing JSON data: {e}")
             return jsonify({'error': f'Invalid JSON data: {str(e)}'}), 400
     
     if not isinstance(json_data, list):
-        print(f"❌ Error: json_data is not a list, it's {type(json_data)}")
+        logger.error(f"❌ Error: json_data is not a list, it's {type(json_data)}")
         return jsonify({'error': 'Data must be a list of keywords'}), 400
     
-    print(f"Generating content for {len(json_data)} keywords")
+    logger.info(f"Generating content for {len(json_data)} keywords")
     if identifier:
-        print(f"🔍 Using identifier: {identifier}")
+        logger.debug("🔍 Using identifier: %s", identifier)
     
     # Create the structured JSON for AI processing (without hero section)
-    structured_data = {
-        'head': {
-            'title': '',
-            'meta_description': ''
-        },
-        'body': {
-            'h1_keywords': [],
-            'h2_keywords': [],
-            'faqs_html': []
-        }
+    structured_data = build_structured(json_data)
+    
+    hero = {
+        'tagline': tagline,
+        'cta_text': cta_text,
+        'cta_link': cta_link,
+        'image_url': image_url,
+        'alt_text': alt_text
     }
     
-    # Add H1 keywords
-    h1_keywords = [kw for kw in json_data if kw['tag'] == 'H1']
-    h1_keywords.sort(key=lambda x: x['order'])
-    for kw in h1_keywords:
-        structured_data['body']['h1_keywords'].append({
-            'keyword': str(kw['keyword'])
-        })
-    
-    # Add H2 keywords with their related H3 keywords
-    h2_keywords = [kw for kw in json_data if kw['tag'] == 'H2']
-    h3_keywords = [kw for kw in json_data if kw['tag'] == 'H3']
-    
-    h2_keywords.sort(key=lambda x: x['order'])
-    h3_keywords.sort(key=lambda x: x['order'])
+    # Use the shared Gemini model
+    model = GEMINI_MODEL
+    if not model:
+        return jsonify({'error': 'Failed to setup Gemini AI'}), 500
+    
+    # Clients that accept an event stream get progress as each section finishes
+    if request.accept_mimetypes.best == 'text/event-stream':
+        return Response(
+            stream_generate_article(model, structured_data, identifier, hero, images_data, regenerate),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache'}
+        )
     
-    for h2_kw in h2_keywords:
-        h2_entry = {
-            'keyword': str(h2_kw['keyword']),
-            'paragraphs': [],
-            'bullets': [],
-            'h3_keywords': []
-        }
-        
-        # Find H3 keywords that belong to this H2 using parent_id
-        for h3_kw in h3_keywords:
-            if h3_kw.get('parent_id') == h2_kw['id']:
-                h2_entry['h3_keywords'].append({
-                    'keyword': str(h3_kw['keyword']),
-                    'paragraphs': [],
-                    'bullets': []
-                })
-        
-        structured_data['body']['h2_keywords'].append(h2_entry)
+    # API clients can take a job id to poll instead of holding the request open
+    if 'respond-async' in request.headers.get('Prefer', ''):
+        job_id = start_generation_job(model, structured_data, identifier, hero, images_data, regenerate)
+        status_url = url_for('generation_status', job_id=job_id)
+        return {'job_id': job_id, 'status_url': status_url}, 202, {'Location': status_url}
     
-    try:
-        # Setup Gemini
-        model = setup_gemini()
-        if not model:
-            return jsonify({'error': 'Failed to setup Gemini AI'}), 500
-        
-        # Create prompt
-        prompt = create_prompt(structured_data)
-        
-        # Send to Gemini
-        print("🔄 Sending request to Gemini AI...")
-        start_time = time.time()
-        try:
-            response = model.generate_content(prompt)
-            processing_time = time.time() - start_time
-            print(f"✅ Gemini API call completed in {processing_time:.1f}s")
-        except Exception as e:
-            print(f"❌ Error calling Gemini API: {e}")
-            import traceback
-            traceback.print_exc()
-            return jsonify({'error': f'Failed to call Gemini API: {str(e)}'}), 500
-        
-        print(f"🔍 Raw response from Gemini: {response}")
-        print(f"🔍 Response type: {type(response)}")
-        print(f"🔍 Response text: {response.text if hasattr(response, 'text') else 'No text attribute'}")
-        
-        if response and hasattr(response, 'text') and response.text and response.text.strip():
-            print(f"🔍 Response text length: {len(response.text)}")
-            print(f"🔍 Response text preview: {response.text[:200]}...")
-            
-            # Clean the response
-            cleaned_result = clean_json_response(response.text)
-            print(f"🔍 Cleaned result length: {len(cleaned_result) if cleaned_result else 0}")
-            print(f"🔍 Cleaned result: '{cleaned_result}'")
-            
-            if not cleaned_result or not cleaned_result.strip():
-                print("❌ Error: Cleaned result is empty")
-                print(f"🔍 Original response text: '{response.text}'")
-                return jsonify({'error': 'AI returned empty response'}), 500
-            
-            # Try to parse as JSON
-            try:
-                ai_generated_data = json.loads(cleaned_result)
-                print(f"✅ JSON parsed successfully, data keys: {list(ai_generated_data.keys())}")
-            except json.JSONDecodeError as e:
-                print(f"❌ Error: Response is not valid JSON: {e}")
-                print(f"❌ Failed to parse: {cleaned_result}")
-                import traceback
-                traceback.print_exc()
-                return jsonify({'error': 'AI response is not valid JSON'}), 500
-            
-            # Validate FAQ count
-            faqs_count = len(ai_generated_data.get('body', {}).get('faqs_html', []))
-            if faqs_count < 15:
-                print(f"⚠️ Warning: Generated {faqs_count} FAQs (minimum 15 required). Regenerating...")
-                # Try to regenerate with a more explicit prompt
-                enhanced_prompt = prompt + "\n\nCRITICAL REMINDER: You MUST generate AT LEAST 15 FAQs in the faqs_html array. Current count: " + str(faqs_count) + ". Please regenerate with at least 15 FAQs (20 preferred)."
-                try:
-                    response = model.generate_content(enhanced_prompt)
-                    if response and hasattr(response, 'text') and response.text:
-                        cleaned_result = clean_json_response(response.text)
-                        try:
-                            ai_generated_data = json.loads(cleaned_result)
-                            faqs_count = len(ai_generated_data.get('body', {}).get('faqs_html', []))
-                            print(f"✅ Regenerated with {faqs_count} FAQs")
-                        except json.JSONDecodeError:
-                            print("⚠️ Regeneration failed, using original result")
-                except Exception as e:
-                    print(f"⚠️ Regeneration failed: {e}, using original result")
-            elif faqs_count < 20:
-                print(f"✅ Generated {faqs_count} FAQs (acceptable range: 15-20)")
-            else:
-                print(f"✅ Generated {faqs_count} FAQs (perfect!)")
-            
-            # Add identifier to the final output if provided
-            if identifier:
-                ai_generated_data['identifier'] = identifier
-            
-            # Add hero section manually (not generated by AI)
-            ai_generated_data['hero'] = {
-                'tagline': tagline,
-                'cta_text': cta_text,
-                'cta_link': cta_link,
-                'image_url': image_url,
-                'alt_text': alt_text
-            }
-            
-            # Add images field manually (not generated by AI)
-            ai_generated_data['images'] = images_data
-            
-            # Validate and fix JSON before saving
-            validated_data = validate_and_fix_json(ai_generated_data)
-            if validated_data is None:
-                print("❌ Failed to validate JSON data")
-                return jsonify({'error': 'Failed to validate JSON data'}), 500
-            
-            ai_generated_data = validated_data
-            
-            # Generate FAQ schema for script field
-            try:
-                faq_schema = generate_faq_schema(ai_generated_data.get('body', {}).get('faqs_html', []))
-                ai_generated_data['script'] = {
-                    'faq_schema': faq_schema
-                }
-            except Exception as e:
-                print(f"⚠️ Warning: Error generating FAQ schema: {e}")
-                # Provide empty schema as fallback
-                ai_generated_data['script'] = {
-                    'faq_schema': {}
-                }
-            
-            # Reorder keys to match required structure: hero, head, body, images, script, identifier
-            ordered_data = {}
-            if 'hero' in ai_generated_data:
-                ordered_data['hero'] = ai_generated_data['hero']
-            if 'head' in ai_generated_data:
-                ordered_data['head'] = ai_generated_data['head']
-            if 'body' in ai_generated_data:
-                ordered_data['body'] = ai_generated_data['body']
-            if 'images' in ai_generated_data:
-                ordered_data['images'] = ai_generated_data['images']
-            if 'script' in ai_generated_data:
-                ordered_data['script'] = ai_generated_data['script']
-            if 'identifier' in ai_generated_data:
-                ordered_data['identifier'] = ai_generated_data['identifier']
-            
-            # Final validation before saving
-            final_validated_data = validate_and_fix_json(ordered_data)
-            if final_validated_data is None:
-                print("❌ Failed to validate final JSON data")
-                return jsonify({'error': 'Failed to validate final JSON data'}), 500
-            
-            ordered_data = final_validated_data
-            
-            # Create output filename with handle
-            h1_keywords = [kw for kw in json_data if kw['tag'] == 'H1']
-            filename = 'keyword_content'
-            
-            # Use handle from identifier if available and valid
-            handle_part = ''
-            if identifier and isinstance(identifier, dict) and 'handle' in identifier:
-                handle = identifier['handle']
-                is_valid, result = validate_handle(handle)
-                if is_valid:
-                    handle_part = f"{result}_"
-                else:
-                    print(f"⚠️ Warning: Invalid handle '{handle}': {result}")
-            
-            # Fallback to H1 keyword if no valid handle
-            if not handle_part and h1_keywords:
-                h1_keyword = h1_keywords[0]['keyword']
-                clean_filename = re.sub(r'[^\w\s-]', '', h1_keyword)
-                clean_filename = re.sub(r'[-\s]+', '_', clean_filename)
-                filename = clean_filename.lower()
-            elif handle_part:
-                filename = handle_part.rstrip('_')  # Remove trailing underscore
-            
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            output_filename = f'{filename}_filled_{timestamp}.json'
-            
-            # Create the target directory if it doesn't exist
-            target_dir = 'D:/articles/nails'
-            os.makedirs(target_dir, exist_ok=True)
-            
-            # Full path for the output file
-            output_path = os.path.join(target_dir, output_filename)
-            
-            # Save the result to the target directory
-            try:
-                with open(output_path, 'w', encoding='utf-8') as file:
-                    json.dump(ordered_data, file, indent=2, ensure_ascii=False)
-                
-                print(f"✅ Content generated and saved to: {output_path}")
-                
-                # Create response data
-                response_data = {
-                    'success': True,
-                    'message': f'Content generated successfully in {processing_time:.1f}s',
-                    'filename': output_filename,
-                    'file_path': output_path,
-                    'summary': {
-                        'title': ordered_data.get('head', {}).get('title', 'Not provided'),
-                        'meta_description': ordered_data.get('head', {}).get('meta_description', 'Not provided'),
-                        'hero_tagline': ordered_data.get('hero', {}).get('tagline', 'Not provided'),
-                        'hero_cta': ordered_data.get('hero', {}).get('cta_text', 'Not provided'),
-                        'hero_cta_link': ordered_data.get('hero', {}).get('cta_link', 'Not provided'),
-                        'h2_sections': len(ordered_data.get('body', {}).get('h2_keywords', [])),
-                        'faqs_generated': len(ordered_data.get('body', {}).get('faqs_html', [])),
-                        'faqs_status': _get_faq_status(len(ordered_data.get('body', {}).get('faqs_html', []))),
-                        'images_count': len(ordered_data.get('images', [])),
-                        'script_faq_schema': '✅ FAQ Schema generated' if ordered_data.get('script', {}).get('faq_schema') and ordered_data.get('script', {}).get('faq_schema').get('mainEntity') else '❌ No FAQ Schema'
-                    }
-                }
-                
-                print(f"✅ Response data prepared: {response_data}")
-                return jsonify(response_data)
-                
-            except Exception as file_error:
-                print(f"❌ Error saving file or creating response: {file_error}")
-                import traceback
-                traceback.print_exc()
-                return jsonify({'error': f'Error saving file: {str(file_error)}'}), 500
-        else:
-            print("❌ Error: No valid response from Gemini AI")
-            if response:
-                print(f"❌ Response object: {response}")
-                if hasattr(response, 'text'):
-                    print(f"❌ Response text: '{response.text}'")
-            return jsonify({'error': 'No valid response from Gemini AI'}), 500
-            
-    except Exception as e:
-        print(f"❌ Error generating content: {e}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({'error': f'Error generating content: {str(e)}'}), 500
+    response_data, status = generate_article(model, structured_data, identifier, hero, images_data, regenerate=regenerate)
+    return Response(orjson.dumps(response_data), status=status, mimetype='application/json')
+
+@app.route('/generation_status/<job_id>')
+def generation_status(job_id):
+    """Progress of a background generation, with the /generate_content body once it finishes"""
+    job = generation_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return job
 
 @app.route('/download_generated/<filename>')
 def download_generated_file(filename):
     """Serve generated JSON files for download"""
     try:
-        # Check if file exists and is a JSON file
-        target_dir = 'D:/articles/nails'
-        file_path = os.path.join(target_dir, filename)
+        # Generated names are word characters and hyphens only, so anything else is not ours
+        if not _ARTICLE_NAME_RE.fullmatch(filename):
+            logger.error(f"❌ File not found: {filename}")
+            return _static_error(_FILE_NOT_FOUND_JSON, 404)
+        
+        # Recent articles are served from memory, even before their disk write finishes
+        with _generated_articles_lock:
+            payload = _generated_articles.get(filename)
+        if payload is not None:
+            logger.info(f"✅ Serving file for download from memory: {filename}")
+            return Response(
+                payload,
+                mimetype='application/json',
+                headers={'Content-Disposition': f"attachment; filename*=UTF-8''{quote(filename)}"}
+            )
+        
+        # Say so when an article that left memory never made it to disk
+        with _generated_articles_lock:
+            write_error = _failed_article_writes.get(filename)
+        if write_error is not None:
+            logger.error(f"❌ File was not saved: {filename}")
+            return jsonify({'error': f'File was not saved: {write_error}'}), 500
         
-        if not filename.endswith('.json') or not os.path.exists(file_path):
-            print(f"❌ File not found: {file_path}")
-            return jsonify({'error': 'File not found'}), 404
+        # Older articles come from disk. send_file's own stat doubles as the existence
+        # check, and conditional requests get a 304 via the ETag
+        file_path = safe_join(ARTICLES_DIR, filename)
+        if file_path is None:
+            logger.error(f"❌ File not found: {filename}")
+            return _static_error(_FILE_NOT_FOUND_JSON, 404)
         
-        print(f"✅ Serving file for download: {file_path}")
+        logger.info(f"✅ Serving file for download: {filename}")
         return send_file(
             file_path,
             as_attachment=True,
             download_name=filename,
-            mimetype='application/json'
+            mimetype='application/json',
+            conditional=True,
+            etag=True,
+            max_age=0
         )
+    except (FileNotFoundError, IsADirectoryError):
+        logger.error(f"❌ File not found: {filename}")
+        return _static_error(_FILE_NOT_FOUND_JSON, 404)
     except Exception as e:
-        print(f"❌ Error serving file {filename}: {e}")
-        return jsonify({'error': 'Error serving file'}), 500
+        logger.error(f"❌ Error serving file {filename}: {e}")
+        return _static_error(_SERVE_ERROR_JSON, 500)
 
 # Image Upload Routes
 import requests
 from PIL import Image
-import io
 import cloudinary
 import cloudinary.uploader
 import cloudinary.api
@@ -1151,23 +1802,23 @@ def search_pexels():
 @app.route('/upload_to_cloudinary', methods=['POST'])
 def upload_to_cloudinary():
     """Upload local image to Cloudinary"""
-    print("Cloudinary upload endpoint called")  # Debug log
+    logger.debug("Cloudinary upload endpoint called")
     
     if 'file' not in request.files:
-        print("No file in request.files")  # Debug log
+        logger.debug("No file in request.files")
         return jsonify({'error': 'No file provided'}), 400
     
     file = request.files['file']
     filename = request.form.get('filename', 'image')
     
-    print(f"File received: {file.filename}, filename: {filename}")  # Debug log
+    logger.debug("File received: %s, filename: %s", file.filename, filename)
     
     if file.filename == '':
-        print("Empty filename")  # Debug log
+        logger.debug("Empty filename")
         return jsonify({'error': 'No file selected'}), 400
     
     try:
-        print("Attempting Cloudinary upload...")  # Debug log
+        logger.debug("Attempting Cloudinary upload...")
         # Upload to Cloudinary with custom public_id (filename)
         result = cloudinary.uploader.upload(
             file,
@@ -1176,7 +1827,7 @@ def upload_to_cloudinary():
             resource_type="image"
         )
         
-        print(f"Cloudinary upload successful: {result['secure_url']}")  # Debug log
+        logger.info(f"Cloudinary upload successful: {result['secure_url']}")
         
         return jsonify({
             'success': True,
@@ -1185,9 +1836,7 @@ def upload_to_cloudinary():
         })
         
     except Exception as e:
-        print(f"Cloudinary upload error: {e}")  # Debug log
-        import traceback
-        traceback.print_exc()  # Print full error traceback
+        logger.exception(f"Cloudinary upload error: {e}")
         return jsonify({'error': f'Error uploading to Cloudinary: {str(e)}'}), 500
 
 @app.route('/upload_pexels_to_cloudinary', methods=['POST'])
@@ -1225,4 +1874,10 @@ def upload_pexels_to_cloudinary():
         return jsonify({'error': f'Error uploading to Cloudinary: {str(e)}'}), 500
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    if os.getenv('FLASK_ENV') == 'development':
+        app.run(debug=True, host='0.0.0.0', port=5000)
+    else:
+        # One process with a thread pool: keyword data and the Gemini loop live in
+        # this process, and threads let other requests run during Gemini calls
+        from waitress import serve
+        serve(app, host='0.0.0.0', port=5000, threads=int(os.getenv('WAITRESS_THREADS', '16')))
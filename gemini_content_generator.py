@@ -1,6 +1,7 @@
-import json
+import orjson
 import google.generativeai as genai
 import os
+import re
 from typing import Dict, Any
 from datetime import datetime
 import time
@@ -32,23 +33,23 @@ def setup_gemini():
 def load_json_data(file_path: str) -> Dict[str, Any]:
     """Load JSON data from file"""
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            return json.load(file)
+        with open(file_path, 'rb') as file:
+            return orjson.loads(file.read())
     except FileNotFoundError:
         print(f"❌ Error: {file_path} not found")
         return None
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         print(f"❌ Error: Invalid JSON in {file_path}: {e}")
         return None
 
-def create_prompt(json_data: Dict[str, Any]) -> str:
-    """Create a comprehensive prompt for Gemini AI"""
-    
-    prompt = f"""
+# The instructions never change, so only the JSON between them is built per call
+_PROMPT_PREFIX = """
 You are an expert content writer and SEO specialist. You will receive a JSON structure for an article and need to fill it with high-quality, SEO-optimized content.
 
 CURRENT JSON STRUCTURE:
-{json.dumps(json_data, indent=2)}
+"""
+
+_PROMPT_SUFFIX = """
 
 Your tasks:
 
@@ -74,7 +75,10 @@ CRITICAL REQUIREMENTS:
 
 IMPORTANT: Return ONLY valid JSON. Do not include any explanations, markdown formatting, or text outside the JSON structure. The response must be parseable as valid JSON.
 """
-    return prompt
+
+def create_prompt(json_data: Dict[str, Any]) -> str:
+    """Create a comprehensive prompt for Gemini AI"""
+    return _PROMPT_PREFIX + orjson.dumps(json_data).decode('utf-8') + _PROMPT_SUFFIX
 
 def send_to_gemini(model, prompt: str) -> str:
     """Send prompt to Gemini AI and get response"""
@@ -86,93 +90,108 @@ def send_to_gemini(model, prompt: str) -> str:
         print(f"❌ Error communicating with Gemini AI: {e}")
         return None
 
+# Cleanup patterns for AI responses, compiled once
+_TRAILING_COMMA_RE = re.compile(r',(\s*[}\]])')
+_RESPONSE_COMMA_RE = re.compile(r',(\s*[}\]"])')
+_TRAILING_JUNK_RE = re.compile(r'[^\w\s\{\}\[\]",:.\-_\s]+$')
+_TRAILING_QUOTE_RE = re.compile(r"'$")
+
+def extract_json_span(text: str) -> str:
+    """Return the first balanced JSON object in text, or None (braces inside strings are ignored)"""
+    start = text.find('{')
+    if start == -1:
+        return None
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return None
+
 def clean_json_response(response: str) -> str:
     """Clean and extract JSON from AI response"""
-    import re
-    
     # Try direct JSON parsing first
     try:
-        json.loads(response)
+        orjson.loads(response)
         return response
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         pass
     
     # Try to extract JSON from the response
-    json_match = re.search(r'\{.*\}', response, re.DOTALL)
-    if json_match:
-        extracted_json = json_match.group(0)
-        
+    extracted_json = extract_json_span(response)
+    if extracted_json:
         # Try to fix common JSON issues
         cleaned_json = extracted_json
         
-        # Fix trailing commas before closing braces and brackets
-        cleaned_json = re.sub(r',(\s*[}\]])', r'\1', cleaned_json)
-        
-        # Fix trailing commas before closing quotes
-        cleaned_json = re.sub(r',(\s*")', r'\1', cleaned_json)
-        
-        # Fix trailing commas in object properties
-        cleaned_json = re.sub(r',(\s*})', r'\1', cleaned_json)
-        
-        # Fix trailing commas in arrays
-        cleaned_json = re.sub(r',(\s*\])', r'\1', cleaned_json)
+        # Fix trailing commas before closing braces, brackets and quotes in one pass
+        cleaned_json = _RESPONSE_COMMA_RE.sub(r'\1', cleaned_json)
         
         # Remove any stray characters at the end
-        cleaned_json = re.sub(r'[^\w\s\{\}\[\]",:.\-_\s]+$', '', cleaned_json)
+        cleaned_json = _TRAILING_JUNK_RE.sub('', cleaned_json)
         
         # Remove any trailing single quotes
-        cleaned_json = re.sub(r"'$", '', cleaned_json)
+        cleaned_json = _TRAILING_QUOTE_RE.sub('', cleaned_json)
         
         try:
-            json.loads(cleaned_json)
+            orjson.loads(cleaned_json)
             print("✅ JSON extracted and cleaned from response")
             return cleaned_json
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             try:
-                json.loads(extracted_json)
+                orjson.loads(extracted_json)
                 print("✅ JSON extracted from response")
                 return extracted_json
-            except json.JSONDecodeError:
+            except orjson.JSONDecodeError:
                 pass
     
     return response
 
 def validate_and_fix_json(json_data):
     """Validate and fix JSON data before saving"""
-    import re
-    
     if isinstance(json_data, str):
         # If it's a string, try to parse it first
         try:
-            json_data = json.loads(json_data)
-        except json.JSONDecodeError as e:
+            json_data = orjson.loads(json_data)
+        except orjson.JSONDecodeError as e:
             print(f"❌ JSON validation failed: {e}")
             return None
     
     # Convert back to string for cleaning
-    json_string = json.dumps(json_data, indent=2, ensure_ascii=False)
+    json_string = orjson.dumps(json_data, option=orjson.OPT_INDENT_2).decode('utf-8')
     
     # Apply comprehensive cleaning
     cleaned_json = json_string
     
-    # Fix trailing commas in objects
-    cleaned_json = re.sub(r',(\s*})', r'\1', cleaned_json)
-    
-    # Fix trailing commas in arrays
-    cleaned_json = re.sub(r',(\s*\])', r'\1', cleaned_json)
+    # Fix trailing commas in objects and arrays
+    cleaned_json = _TRAILING_COMMA_RE.sub(r'\1', cleaned_json)
     
     # Remove any stray characters at the end
-    cleaned_json = re.sub(r'[^\w\s\{\}\[\]",:.\-_\s]+$', '', cleaned_json)
+    cleaned_json = _TRAILING_JUNK_RE.sub('', cleaned_json)
     
     # Remove any trailing single quotes
-    cleaned_json = re.sub(r"'$", '', cleaned_json)
+    cleaned_json = _TRAILING_QUOTE_RE.sub('', cleaned_json)
     
     # Try to parse the cleaned JSON
     try:
-        validated_data = json.loads(cleaned_json)
+        validated_data = orjson.loads(cleaned_json)
         print("✅ JSON validated and cleaned successfully")
         return validated_data
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         print(f"❌ JSON validation failed after cleaning: {e}")
         return None
 
@@ -184,7 +203,7 @@ def save_result(result: str, original_file: str) -> bool:
         
         # Try to parse as JSON
         try:
-            json_data = json.loads(cleaned_result)
+            json_data = orjson.loads(cleaned_result)
             
             # Validate and fix JSON before saving
             validated_data = validate_and_fix_json(json_data)
@@ -204,7 +223,7 @@ def save_result(result: str, original_file: str) -> bool:
                 print(f"⚠️ Warning: Generated {faqs_count} FAQs instead of 20.")
                 print("⚠️ Please regenerate content to get exactly 20 FAQs.")
                     
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             print(f"❌ Error: Response is not valid JSON: {e}")
             print("\n📄 Raw AI Response:")
             print("-" * 50)
@@ -218,8 +237,8 @@ def save_result(result: str, original_file: str) -> bool:
         output_file = f"{base_name}_filled_{timestamp}.json"
         
         # Save the result
-        with open(output_file, 'w', encoding='utf-8') as file:
-            json.dump(json_data, file, indent=2, ensure_ascii=False)
+        with open(output_file, 'wb') as file:
+            file.write(orjson.dumps(json_data, option=orjson.OPT_INDENT_2))
         
         print(f"✅ Result saved to: {output_file}")
         
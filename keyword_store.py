@@ -0,0 +1,284 @@
+"""Per-session keyword storage and generation job state shared by the Flask routes"""
+import sqlite3
+import threading
+import time
+
+import orjson
+
+
+class MemoryKeywordStore:
+    """
+    Thread-safe in-process keyword storage, one keyword list per session
+    Each session keeps its keyword list plus an index of the same records by id.
+    Every read-modify-write runs under a single re-entrant lock. With a ttl, sessions
+    that have not changed for that many seconds are dropped on the next upload
+    """
+
+    def __init__(self, ttl=0):
+        self._lock = threading.RLock()
+        self._sessions = {}
+        self._ttl = ttl
+
+    def _set(self, sid, keywords_data):
+        self._sessions[sid] = {
+            'data': keywords_data,
+            'index': {kw['id']: kw for kw in keywords_data},
+            'updated_at': time.monotonic()
+        }
+
+    def _expire(self):
+        if not self._ttl:
+            return
+        oldest = time.monotonic() - self._ttl
+        for sid in [sid for sid, entry in self._sessions.items() if entry['updated_at'] < oldest]:
+            del self._sessions[sid]
+
+    def has_data(self, sid):
+        with self._lock:
+            return sid in self._sessions
+
+    def get(self, sid):
+        """Return a snapshot of the session's keyword list, or None if nothing was loaded"""
+        with self._lock:
+            entry = self._sessions.get(sid)
+            return list(entry['data']) if entry else None
+
+    def set(self, sid, keywords_data):
+        """Replace the session's keyword list"""
+        with self._lock:
+            self._expire()
+            self._set(sid, keywords_data)
+
+    def filter(self, sid, min_volume):
+        """Return keywords with at least min_volume searches, renumbering their order"""
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry is None:
+                return None
+            entry['updated_at'] = time.monotonic()
+            filtered_data = [kw for kw in entry['data'] if kw['volume'] >= min_volume]
+            for i, kw in enumerate(filtered_data):
+                kw['order'] = i
+            return filtered_data
+
+    def update_tags(self, sid, updates):
+        """Apply a list of {'id', 'tag'} updates"""
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry is None:
+                return
+            entry['updated_at'] = time.monotonic()
+            index = entry['index']
+            for update in updates:
+                kw = index.get(update.get('id'))
+                if kw is not None:
+                    kw['tag'] = update.get('tag', '')
+
+    def remove(self, sid, keyword_id):
+        """Remove a keyword and renumber the remaining order"""
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry is None:
+                return
+            entry['updated_at'] = time.monotonic()
+            if entry['index'].pop(keyword_id, None) is not None:
+                entry['data'] = [kw for kw in entry['data'] if kw['id'] != keyword_id]
+            for i, kw in enumerate(entry['data']):
+                kw['order'] = i
+
+    def reorder(self, sid, new_order):
+        """Keep only the keywords listed in new_order, in that order"""
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry is None:
+                return
+            index = entry['index']
+            reordered_data = []
+            for i, keyword_id in enumerate(new_order):
+                kw = index.get(keyword_id)
+                if kw is not None:
+                    kw['order'] = i
+                    reordered_data.append(kw)
+            self._set(sid, reordered_data)
+
+
+class SqliteKeywordStore:
+    """
+    Keyword storage in a SQLite file, so several server processes can share sessions
+    Each keyword record is stored as JSON with its session, list position, id and
+    volume in indexed columns; tag and order changes are applied in place with json_set.
+    With a ttl, sessions that have not changed for that many seconds are dropped on the
+    next upload
+    """
+
+    def __init__(self, path, ttl=0):
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(
+            'CREATE TABLE IF NOT EXISTS sessions (sid TEXT PRIMARY KEY, updated_at REAL NOT NULL);'
+            'CREATE TABLE IF NOT EXISTS keywords ('
+            'sid TEXT NOT NULL, pos INTEGER NOT NULL, id, volume REAL, data TEXT NOT NULL, '
+            'PRIMARY KEY (sid, pos));'
+            'CREATE INDEX IF NOT EXISTS keywords_sid_id ON keywords (sid, id);'
+        )
+        self._conn.commit()
+
+    def _set(self, sid, keywords_data):
+        self._conn.execute('DELETE FROM keywords WHERE sid = ?', (sid,))
+        self._conn.executemany(
+            'INSERT INTO keywords (sid, pos, id, volume, data) VALUES (?, ?, ?, ?, ?)',
+            [
+                (sid, pos, kw['id'], kw.get('volume'), orjson.dumps(kw).decode('utf-8'))
+                for pos, kw in enumerate(keywords_data)
+            ]
+        )
+        self._conn.execute('INSERT OR REPLACE INTO sessions (sid, updated_at) VALUES (?, ?)', (sid, time.time()))
+
+    def _expire(self):
+        if not self._ttl:
+            return
+        oldest = time.time() - self._ttl
+        self._conn.execute('DELETE FROM keywords WHERE sid IN (SELECT sid FROM sessions WHERE updated_at < ?)', (oldest,))
+        self._conn.execute('DELETE FROM sessions WHERE updated_at < ?', (oldest,))
+
+    def _touch(self, sid):
+        self._conn.execute('UPDATE sessions SET updated_at = ? WHERE sid = ?', (time.time(), sid))
+
+    def _renumber(self, sid, positions):
+        """Set 'order' to 0..n-1 on the records at the given list positions"""
+        self._conn.executemany(
+            "UPDATE keywords SET data = json_set(data, '$.order', ?) WHERE sid = ? AND pos = ?",
+            [(i, sid, pos) for i, pos in enumerate(positions)]
+        )
+
+    def has_data(self, sid):
+        with self._lock:
+            return self._conn.execute('SELECT 1 FROM sessions WHERE sid = ?', (sid,)).fetchone() is not None
+
+    def get(self, sid):
+        """Return the session's keyword list, or None if nothing was loaded"""
+        with self._lock:
+            if self._conn.execute('SELECT 1 FROM sessions WHERE sid = ?', (sid,)).fetchone() is None:
+                return None
+            rows = self._conn.execute('SELECT data FROM keywords WHERE sid = ? ORDER BY pos', (sid,))
+            return [orjson.loads(data) for data, in rows]
+
+    def set(self, sid, keywords_data):
+        """Replace the session's keyword list"""
+        with self._lock, self._conn:
+            self._expire()
+            self._set(sid, keywords_data)
+
+    def filter(self, sid, min_volume):
+        """Return keywords with at least min_volume searches, renumbering their order"""
+        with self._lock, self._conn:
+            if self._conn.execute('SELECT 1 FROM sessions WHERE sid = ?', (sid,)).fetchone() is None:
+                return None
+            self._touch(sid)
+            rows = self._conn.execute(
+                'SELECT pos FROM keywords WHERE sid = ? AND volume >= ? ORDER BY pos', (sid, min_volume)
+            ).fetchall()
+            self._renumber(sid, [pos for pos, in rows])
+            rows = self._conn.execute(
+                'SELECT data FROM keywords WHERE sid = ? AND volume >= ? ORDER BY pos', (sid, min_volume)
+            )
+            return [orjson.loads(data) for data, in rows]
+
+    def update_tags(self, sid, updates):
+        """Apply a list of {'id', 'tag'} updates"""
+        with self._lock, self._conn:
+            self._touch(sid)
+            self._conn.executemany(
+                "UPDATE keywords SET data = json_set(data, '$.tag', ?) WHERE sid = ? AND id = ?",
+                [(update.get('tag', ''), sid, update.get('id')) for update in updates]
+            )
+
+    def remove(self, sid, keyword_id):
+        """Remove a keyword and renumber the remaining order"""
+        with self._lock, self._conn:
+            self._touch(sid)
+            self._conn.execute('DELETE FROM keywords WHERE sid = ? AND id = ?', (sid, keyword_id))
+            rows = self._conn.execute('SELECT pos FROM keywords WHERE sid = ? ORDER BY pos', (sid,)).fetchall()
+            self._renumber(sid, [pos for pos, in rows])
+
+    def reorder(self, sid, new_order):
+        """Keep only the keywords listed in new_order, in that order"""
+        with self._lock, self._conn:
+            if self._conn.execute('SELECT 1 FROM sessions WHERE sid = ?', (sid,)).fetchone() is None:
+                return
+            rows = self._conn.execute('SELECT id, data FROM keywords WHERE sid = ? ORDER BY pos', (sid,))
+            index = {keyword_id: data for keyword_id, data in rows}
+            reordered_data = []
+            for i, keyword_id in enumerate(new_order):
+                data = index.get(keyword_id)
+                if data is not None:
+                    kw = orjson.loads(data)
+                    kw['order'] = i
+                    reordered_data.append(kw)
+            self._set(sid, reordered_data)
+
+
+class MemoryJobStore:
+    """
+    In-process state of background generation jobs, keyed by job id
+    Jobs that have not been updated for ttl seconds are dropped on the next update.
+    Running jobs report progress as each Gemini call finishes, so only finished or
+    abandoned jobs expire
+    """
+
+    def __init__(self, ttl=3600):
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._ttl = ttl
+
+    def set(self, job_id, job):
+        """Store the current state of a job"""
+        with self._lock:
+            oldest = time.monotonic() - self._ttl
+            for expired_id in [key for key, (_, updated_at) in self._jobs.items() if updated_at < oldest]:
+                del self._jobs[expired_id]
+            self._jobs[job_id] = (dict(job), time.monotonic())
+
+    def get(self, job_id):
+        """Return a copy of the job's state, or None for an unknown or expired job"""
+        with self._lock:
+            entry = self._jobs.get(job_id)
+            return dict(entry[0]) if entry else None
+
+
+class SqliteJobStore:
+    """
+    Generation job state in a SQLite file, so a job can be polled from any server process
+    Each job is stored as JSON with the time of its last update, and jobs that have
+    not been updated for ttl seconds are deleted on the next update
+    """
+
+    def __init__(self, path, ttl=3600):
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS generation_jobs (job_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)'
+        )
+        self._conn.commit()
+
+    def set(self, job_id, job):
+        """Store the current state of a job"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM generation_jobs WHERE updated_at < ?', (now - self._ttl,))
+            self._conn.execute(
+                'INSERT OR REPLACE INTO generation_jobs (job_id, data, updated_at) VALUES (?, ?, ?)',
+                (job_id, orjson.dumps(job).decode('utf-8'), now)
+            )
+
+    def get(self, job_id):
+        """Return the job's state, or None for an unknown or expired job"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT data FROM generation_jobs WHERE job_id = ? AND updated_at >= ?', (job_id, time.time() - self._ttl)
+            ).fetchone()
+            return orjson.loads(row[0]) if row else None